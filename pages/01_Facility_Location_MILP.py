@@ -1,11 +1,61 @@
 import streamlit as st
 from src.components.file_handlers import handle_template_download, handle_file_upload
-from src.components.parameter_controls import create_parameter_controls, create_editable_dataframe
-from src.optimization.facility_milp import optimize_facility_locations
-from src.utils.milp_mapping import create_optimization_map
+from src.components.parameter_controls import create_parameter_controls, create_editable_dataframe, create_paginated_dataframe, create_cache_controls
+from src.utils.hashing import hash_dataframe, hash_params
+
+def _data_keys(facilities_df, customers_df, distances_df):
+    """Content keys of the input tables, used to key the cached solvers"""
+    return (
+        hash_dataframe(facilities_df),
+        hash_dataframe(customers_df),
+        hash_dataframe(distances_df) if distances_df is not None else None
+    )
+
+@st.fragment
+def _render_results(facilities_df, customers_df):
+    """Renders the Results section; reruns on its own when only its contents change"""
+    results_expander = st.expander("📊 Results", expanded=st.session_state.get('show_results', False))
+    with results_expander:
+        if facilities_df is None:
+            st.warning("Please upload your data first.")
+        elif 'optimization_results' not in st.session_state:
+            st.info("Run the optimization to see results.")
+        else:
+            results = st.session_state.optimization_results
+            
+            if results['status'] == 'Optimal':
+                # Summary metrics
+                st.subheader("Summary")
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("Total Cost", f"${results['total_cost']:,.2f}")
+                
+                # Detailed results
+                st.subheader("Selected Facilities")
+                st.dataframe(results['results'])
+                
+                st.subheader("Transportation Plan")
+                create_paginated_dataframe(results['transport'], "transport_page")
+                
+                # Display map
+                st.subheader("Location Map")
+                from src.utils.milp_mapping import coord_arrays, create_optimization_map
+                map_deck = create_optimization_map(
+                    *coord_arrays(facilities_df, 'FacilityID'),
+                    *coord_arrays(customers_df, 'CustomerID'),
+                    results['transport'],
+                    results['results'],
+                    deck=st.session_state.get('milp_map_deck')
+                )
+                # Later results only replace the layer data of this deck
+                st.session_state.milp_map_deck = map_deck
+                st.pydeck_chart(map_deck)
+            else:
+                st.error(f"Optimization failed with status: {results['status']}")
 
 def facility_milp_page():
     st.title("Facility Location Optimization (MILP)")
+    create_cache_controls()
     
     with st.expander("📃 Overview", expanded=True):
         # Model description
@@ -29,7 +79,8 @@ def facility_milp_page():
             - Demand quantities
             - Location coordinates (latitude/longitude)
         
-        3. **Distances**: Matrix of distances between each facility and customer
+        3. **Distances** (optional): Distances in miles between each facility and customer. Pairs
+           that are not listed use the great circle distance between their coordinates
         """)
 
     # Data Input Section (expanded by default)
@@ -43,7 +94,8 @@ def facility_milp_page():
         
         # File upload section
         st.subheader("2. Upload Data")
-        dfs, error = handle_file_upload(["facilities", "customers", "distances"])
+        dfs, error = handle_file_upload(["facilities", "customers"], optional_sheets=["distances"])
+        facilities_df = customers_df = distances_df = None
         
         if error:
             st.error(error)
@@ -69,11 +121,14 @@ def facility_milp_page():
                     "customers_table"
                 )
             
-            st.subheader("Distances")
-            distances_df = create_editable_dataframe(
-                dfs["distances"],
-                "distances_table"
-            )
+            if "distances" in dfs:
+                st.subheader("Distances")
+                distances_df = create_editable_dataframe(
+                    dfs["distances"],
+                    "distances_table"
+                )
+            else:
+                st.info("No distances sheet found; great circle distances (miles) will be computed from coordinates.")
 
     # Parameters Section (expands when data is uploaded)
     parameters_expander = st.expander("⚙️ Parameters", expanded=dfs is not None)
@@ -103,7 +158,7 @@ def facility_milp_page():
                 
                 st.markdown("""
                 - **Facility Fixed Cost Multiplier**: Adjusts the weight of facility opening costs
-                - **Cost per Unit Distance**: Adjusts the weight of transportation costs
+                - **Cost per Unit Distance**: Adjusts the weight of transportation costs, per unit shipped per mile
                 """)
             
             with col2:
@@ -111,17 +166,20 @@ def facility_milp_page():
                 solver_params = create_parameter_controls(
                     initial_params={
                         "mip_gap": 0.01,
-                        "max_run_time_seconds": 5
+                        "max_run_time_seconds": 5,
+                        "stagnation_seconds": 30
                     },
                     param_ranges={
                         "mip_gap": (0.005, 0.1,0.005),
-                        "max_run_time_seconds": (5, 600,5)
+                        "max_run_time_seconds": (5, 600,5),
+                        "stagnation_seconds": (5, 600, 5)
                     }
                 )
                 
                 st.markdown("""
                 - **MIP Gap**: Maximum allowed gap between solution and best bound (smaller = more precise but slower)
                 - **Max Runtime**: Maximum time in seconds to spend solving (longer allows for better solutions)
+                - **Stagnation Timeout**: Stop early once the best solution has not improved for this many seconds
                 """)
             
             params.update(solver_params)
@@ -129,63 +187,59 @@ def facility_milp_page():
             # Run optimization button
             if st.button("Run Optimization", type="primary"):
                 with st.spinner("Optimizing facility locations..."):
-                    results = optimize_facility_locations(
+                    # The solver modules pull in PuLP and Numba, so they are imported on first use
+                    from src.components.cached_solvers import cached_facility_milp
+                    data_keys = _data_keys(facilities_df, customers_df, distances_df)
+                    # Reuse the previous incumbent as a MIP start while the data is unchanged
+                    warm_start = st.session_state.get('milp_warm_start')
+                    results = cached_facility_milp(
+                        hash_params(params),
+                        *data_keys,
                         facilities_df,
                         customers_df,
                         distances_df,
-                        **params
+                        params,
+                        _warm_start=warm_start['values'] if warm_start and warm_start['keys'] == data_keys else None
                     )
+                    st.session_state.milp_warm_start = {'keys': data_keys, 'values': results['warm_start']}
                     # Store results in session state
                     st.session_state.optimization_results = results
-                    # Force the results expander to open
+                    # Open the results expander; the results fragment is rendered later in this run,
+                    # so it picks up the new results without a full rerun
                     st.session_state.show_results = True
-                    st.rerun()
 
-    # Results Section (expands when optimization is complete)
-    results_expander = st.expander("📊 Results", expanded=st.session_state.get('show_results', False))
-    with results_expander:
-        if dfs is None:
-            st.warning("Please upload your data first.")
-        elif 'optimization_results' not in st.session_state:
-            st.info("Run the optimization to see results.")
-        else:
-            results = st.session_state.optimization_results
+            # Scenario sweep
+            st.subheader("Scenario Sweep")
+            st.markdown("Solve several fixed cost multipliers in parallel to compare the cost trade-off:")
+            sweep_values = st.multiselect(
+                "facility_fixed_cost_multiplier values",
+                options=[0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0],
+                default=[0.5, 1.0, 2.0]
+            )
             
-            if results['status'] == 'Optimal':
-                # Summary metrics
-                st.subheader("Summary")
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("Total Cost", f"${results['total_cost']:,.2f}")
-                
-                # Detailed results
-                st.subheader("Selected Facilities")
-                st.dataframe(results['results'])
-                
-                st.subheader("Transportation Plan")
-                st.dataframe(results['transport'])
-                
-                # Create facility and customer coordinate dictionaries
-                facility_coords = dict(zip(facilities_df['FacilityID'], 
-                                        zip(facilities_df['Latitude'], 
-                                            facilities_df['Longitude'])))
-                customer_coords = dict(zip(customers_df['CustomerID'], 
-                                        zip(customers_df['Latitude'], 
-                                            customers_df['Longitude'])))
-                
-                # Display map
-                st.subheader("Location Map")
-                map_deck = create_optimization_map(
-                    facilities_df,
-                    customers_df,
-                    results['transport'],
-                    facility_coords,
-                    customer_coords,
-                    results['results']
-                )
-                st.pydeck_chart(map_deck)
-            else:
-                st.error(f"Optimization failed with status: {results['status']}")
+            if st.button("Run Scenario Sweep", disabled=len(sweep_values) < 2):
+                with st.spinner(f"Solving {len(sweep_values)} scenarios..."):
+                    from src.components.cached_solvers import cached_facility_sweep
+                    sweep_params = {name: value for name, value in params.items()
+                                    if name != 'facility_fixed_cost_multiplier'}
+                    st.session_state.milp_sweep_results = cached_facility_sweep(
+                        hash_params(sweep_params),
+                        *_data_keys(facilities_df, customers_df, distances_df),
+                        facilities_df,
+                        customers_df,
+                        distances_df,
+                        'facility_fixed_cost_multiplier',
+                        tuple(sorted(sweep_values)),
+                        sweep_params
+                    )
+            
+            if 'milp_sweep_results' in st.session_state:
+                sweep_df = st.session_state.milp_sweep_results
+                st.dataframe(sweep_df)
+                st.scatter_chart(sweep_df, x='FixedCost', y='TransportCost')
+
+    # Results Section (expands when optimization is complete)
+    _render_results(facilities_df, customers_df)
 
 if __name__ == "__main__":
     facility_milp_page()
\ No newline at end of file
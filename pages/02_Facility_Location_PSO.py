@@ -1,12 +1,65 @@
 import streamlit as st
 import pandas as pd
 from src.components.file_handlers import handle_template_download, handle_file_upload
-from src.components.parameter_controls import create_parameter_controls, create_editable_dataframe
-from src.optimization.facility_pso import optimize_facility_locations_pso
-from src.utils.pso_mapping import create_pso_map
+from src.components.parameter_controls import create_parameter_controls, create_editable_dataframe, create_paginated_dataframe, create_cache_controls
+from src.utils.hashing import hash_dataframe, hash_params
+
+@st.fragment
+def _render_results(customers_df):
+    """Renders the Results section; reruns on its own when only its contents change"""
+    results_expander = st.expander("📊 Results", expanded=st.session_state.get('show_results', False))
+    with results_expander:
+        if customers_df is None:
+            st.warning("Please upload your data first.")
+        elif 'optimization_results' not in st.session_state:
+            st.info("Run the optimization to see results.")
+        else:
+            results = st.session_state.optimization_results
+            
+            if results['status'] == 'Optimal':
+                # Summary metrics
+                st.subheader("Summary")
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("Total Cost", f"${results['total_cost']:,.2f}")
+                with col2:
+                    st.metric("Completed Iterations", f"{results['completed_iterations']}/{results['n_iterations']}")
+                with col3:
+                    st.metric("Total Time", f"{results['total_time']:.2f} seconds")
+                
+                # Optimization progress
+                st.subheader("Optimization Progress")
+                st.line_chart(results['history'].set_index('iteration')['best_score'])
+                
+                # Detailed results
+                st.subheader("Facility Locations")
+                st.dataframe(results['facility_locations'])
+                
+                st.subheader("Customer Assignments")
+                create_paginated_dataframe(results['assignments'], "assignments_page")
+                
+                # Display map
+                st.subheader("Location Map")
+                from src.utils.pso_mapping import create_pso_map
+                map_deck = create_pso_map(
+                    results['facility_locations'],
+                    customers_df,
+                    results['assignments']
+                )
+                st.pydeck_chart(map_deck)
+                
+                st.markdown("""
+                **Map Legend:**
+                - Blue dots: Customers
+                - Green dots: Optimized Facility Locations
+                - Purple lines: Transportation Routes
+                """)
+            else:
+                st.error(f"Optimization failed with status: {results['status']}")
 
 def facility_pso_page():
     st.title("Facility Location Optimization (PSO)")
+    create_cache_controls()
     
     with st.expander("📃 Overview", expanded=True):
         # Model description
@@ -45,6 +98,7 @@ def facility_pso_page():
         # File upload section
         st.subheader("2. Upload Data")
         dfs, error = handle_file_upload(["customers"])
+        customers_df = None
         
         if error:
             st.error(error)
@@ -118,17 +172,20 @@ def facility_pso_page():
                         "n_particles": 30,
                         "n_iterations": 100,
                         "max_run_time_seconds": 10,
+                        "n_restarts": 1,
                     },
                     param_ranges={
                         "n_particles": (5, 100, 5),
                         "n_iterations": (10, 500, 10),
-                        "max_run_time_seconds": (5, 600, 10)
+                        "max_run_time_seconds": (5, 600, 10),
+                        "n_restarts": (1, 8, 1)
                     }
                 )
                 
                 st.markdown("""
                 - **Number of Particles**: Size of the particle swarm
                 - **Number of Iterations**: How long to run the optimization
+                - **Number of Restarts**: Independent swarms run in parallel; the best result is kept
                 """)
             
             with col4:
@@ -157,65 +214,22 @@ def facility_pso_page():
             # Run optimization button
             if st.button("Run Optimization", type="primary"):
                 with st.spinner("Optimizing facility locations..."):
-                    results = optimize_facility_locations_pso(
+                    # The solver modules pull in PuLP and Numba, so they are imported on first use
+                    from src.components.cached_solvers import cached_facility_pso
+                    results = cached_facility_pso(
+                        hash_params(params),
+                        hash_dataframe(customers_df),
                         customers_df,
-                        **params
+                        params
                     )
                     # Store results in session state
-                    st.session_state.optimization_results = results
-                    # Force the results expander to open
+                    st.session_state.optimization_results = dict(results, n_iterations=params['n_iterations'])
+                    # Open the results expander; the results fragment is rendered later in this run,
+                    # so it picks up the new results without a full rerun
                     st.session_state.show_results = True
-                    st.rerun()
 
     # Results Section (expands when optimization is complete)
-    results_expander = st.expander("📊 Results", expanded=st.session_state.get('show_results', False))
-    with results_expander:
-        if dfs is None:
-            st.warning("Please upload your data first.")
-        elif 'optimization_results' not in st.session_state:
-            st.info("Run the optimization to see results.")
-        else:
-            results = st.session_state.optimization_results
-            
-            if results['status'] == 'Optimal':
-                # Summary metrics
-                st.subheader("Summary")
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("Total Cost", f"${results['total_cost']:,.2f}")
-                with col2:
-                    st.metric("Completed Iterations", f"{results['completed_iterations']}/{params['n_iterations']}")
-                with col3:
-                    st.metric("Total Time", f"{results['total_time']:.2f} seconds")
-                
-                # Optimization progress
-                st.subheader("Optimization Progress")
-                st.line_chart(results['history'].set_index('iteration')['best_score'])
-                
-                # Detailed results
-                st.subheader("Facility Locations")
-                st.dataframe(results['facility_locations'])
-                
-                st.subheader("Customer Assignments")
-                st.dataframe(results['assignments'])
-                
-                # Display map
-                st.subheader("Location Map")
-                map_deck = create_pso_map(
-                    results['facility_locations'],
-                    customers_df,
-                    results['assignments']
-                )
-                st.pydeck_chart(map_deck)
-                
-                st.markdown("""
-                **Map Legend:**
-                - Blue dots: Customers
-                - Green dots: Optimized Facility Locations
-                - Purple lines: Transportation Routes
-                """)
-            else:
-                st.error(f"Optimization failed with status: {results['status']}")
+    _render_results(customers_df)
 
 if __name__ == "__main__":
     facility_pso_page()
\ No newline at end of file
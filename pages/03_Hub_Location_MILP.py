@@ -1,11 +1,81 @@
 import streamlit as st
 from src.components.file_handlers import handle_template_download, handle_file_upload
-from src.components.parameter_controls import create_parameter_controls
-from src.optimization.hub_network import optimize_hub_network
-from src.utils.hub_network_mapping import create_hub_network_map
+from src.components.parameter_controls import create_parameter_controls, create_paginated_dataframe, create_cache_controls
+from src.utils.hashing import hash_dataframe, hash_params
+
+@st.fragment
+def _render_results(dfs):
+    """Renders the Results section; reruns on its own when only its contents change"""
+    results_expander = st.expander("📊 Results", expanded=st.session_state.get('show_results', False))
+    with results_expander:
+        if dfs is None:
+            st.warning("Please upload your data first.")
+        elif 'optimization_results' not in st.session_state:
+            st.info("Run the optimization to see results.")
+        else:
+            results = st.session_state.optimization_results
+            
+            if results['status'] == 'Optimal':
+                # Summary metrics
+                st.subheader("Summary")
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("Total Cost", f"${results['total_cost']:,.2f}")
+                with col2:
+                    st.metric("Selected Hubs", 
+                             str(results['facilities']['IsOpen'].sum()))
+                with col3:
+                    st.metric("Solver Time", 
+                             f"{results['solver_time']:.1f} sec" if results['solver_time'] else "N/A")
+
+                # Hub selection results
+                st.subheader("Selected Hubs")
+                selected_hubs = results['facilities'][results['facilities']['IsOpen']]
+                st.dataframe(selected_hubs)
+                
+                # Flow details
+                st.subheader("Flow Details")
+                
+                # Direct flows
+                direct_flows = results['connections'][results['connections']['Type'] == 'Direct']
+                if not direct_flows.empty:
+                    st.subheader("Direct Shipments")
+                    create_paginated_dataframe(direct_flows, "direct_flows_page")
+                
+                # Hub flows
+                hub_flows = results['connections'][results['connections']['Type'] == 'Hub']
+                if not hub_flows.empty:
+                    st.subheader("Hub-Mediated Shipments")
+                    create_paginated_dataframe(hub_flows, "hub_flows_page")
+                
+                # Display map
+                st.subheader("Network Map")
+                from src.utils.hub_network_mapping import create_hub_network_map
+                map_result = create_hub_network_map(
+                    results['connections'],
+                    results['facilities'],
+                    dfs["origins"],
+                    dfs["destinations"],
+                    dfs["candidate_hubs"]
+                )
+                st.pydeck_chart(map_result['deck'])
+                
+                # Map legend
+                st.markdown("""
+                **Legend:**
+                - 🔴 Origins
+                - 🟢 Selected Hubs
+                - ⚪ Unselected Hubs
+                - 🔵 Destinations
+                - Purple lines show shipping routes (width indicates volume)
+                """)
+                
+            else:
+                st.error(f"Optimization failed with status: {results['status']}")
 
 def hub_network_page():
     st.title("Hub Network Optimization")
+    create_cache_controls()
 
     with st.expander("📃 Overview", expanded=True):
         st.markdown("""
@@ -114,11 +184,13 @@ def hub_network_page():
                         "capacity_per_shipment": 3000,
                         "time_limit": 300,
                         "optimality_gap": 0.01,
+                        "stagnation_seconds": 30,
                     },
                     param_ranges={
                         "capacity_per_shipment": (100, 10000, 100),
                         "time_limit": (10, 3600, 10),
-                        "optimality_gap": (0.001, 0.1, 0.001)
+                        "optimality_gap": (0.001, 0.1, 0.001),
+                        "stagnation_seconds": (5, 600, 5)
                     }
                 )
                 
@@ -126,6 +198,7 @@ def hub_network_page():
                 - **Capacity per Shipment**: Maximum units per load
                 - **Time Limit**: Maximum solver runtime in seconds
                 - **Optimality Gap**: Relative optimality gap (smaller = more precise)
+                - **Stagnation Timeout**: Stop early once the best solution has not improved for this many seconds
                 """)
             
             params = {**network_params, **solver_params}
@@ -133,89 +206,39 @@ def hub_network_page():
             # Run optimization button
             if st.button("Run Optimization", type="primary"):
                 with st.spinner("Optimizing hub network..."):
+                    # The solver modules pull in PuLP and Numba, so they are imported on first use
+                    from src.components.cached_solvers import cached_hub_network
                     try:
-                        results = optimize_hub_network(
+                        data_keys = (
+                            hash_dataframe(dfs["origins"]),
+                            hash_dataframe(dfs["candidate_hubs"]),
+                            hash_dataframe(dfs["destinations"]),
+                            hash_dataframe(dfs["demand"])
+                        )
+                        # Reuse the previous incumbent as a MIP start while the data is unchanged
+                        warm_start = st.session_state.get('hub_warm_start')
+                        results = cached_hub_network(
+                            hash_params(params),
+                            *data_keys,
                             dfs["origins"],
                             dfs["candidate_hubs"],
                             dfs["destinations"],
                             dfs["demand"],
-                            **params
+                            params,
+                            _warm_start=warm_start['values'] if warm_start and warm_start['keys'] == data_keys else None
                         )
+                        st.session_state.hub_warm_start = {'keys': data_keys, 'values': results['warm_start']}
                         
                         # Store results in session state
                         st.session_state.optimization_results = results
-                        # Force the results expander to open
+                        # Open the results expander; the results fragment is rendered later in this run,
+                        # so it picks up the new results without a full rerun
                         st.session_state.show_results = True
-                        st.rerun()
                     except Exception as e:
                         st.error(f"Optimization failed: {str(e)}")
 
     # Results Section
-    results_expander = st.expander("📊 Results", expanded=st.session_state.get('show_results', False))
-    with results_expander:
-        if dfs is None:
-            st.warning("Please upload your data first.")
-        elif 'optimization_results' not in st.session_state:
-            st.info("Run the optimization to see results.")
-        else:
-            results = st.session_state.optimization_results
-            
-            if results['status'] == 'Optimal':
-                # Summary metrics
-                st.subheader("Summary")
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("Total Cost", f"${results['total_cost']:,.2f}")
-                with col2:
-                    st.metric("Selected Hubs", 
-                             str(results['facilities']['IsOpen'].sum()))
-                with col3:
-                    st.metric("Solver Time", 
-                             f"{results['solver_time']:.1f} sec" if results['solver_time'] else "N/A")
-
-                # Hub selection results
-                st.subheader("Selected Hubs")
-                selected_hubs = results['facilities'][results['facilities']['IsOpen']]
-                st.dataframe(selected_hubs)
-                
-                # Flow details
-                st.subheader("Flow Details")
-                
-                # Direct flows
-                direct_flows = results['connections'][results['connections']['Type'] == 'Direct']
-                if not direct_flows.empty:
-                    st.subheader("Direct Shipments")
-                    st.dataframe(direct_flows)
-                
-                # Hub flows
-                hub_flows = results['connections'][results['connections']['Type'] == 'Hub']
-                if not hub_flows.empty:
-                    st.subheader("Hub-Mediated Shipments")
-                    st.dataframe(hub_flows)
-                
-                # Display map
-                st.subheader("Network Map")
-                map_result = create_hub_network_map(
-                    results['connections'],
-                    results['facilities'],
-                    dfs["origins"],
-                    dfs["destinations"],
-                    dfs["candidate_hubs"]
-                )
-                st.pydeck_chart(map_result['deck'])
-                
-                # Map legend
-                st.markdown("""
-                **Legend:**
-                - 🔴 Origins
-                - 🟢 Selected Hubs
-                - ⚪ Unselected Hubs
-                - 🔵 Destinations
-                - Purple lines show shipping routes (width indicates volume)
-                """)
-                
-            else:
-                st.error(f"Optimization failed with status: {results['status']}")
+    _render_results(dfs)
 
 if __name__ == "__main__":
     hub_network_page()
\ No newline at end of file
@@ -1,11 +1,138 @@
+import os
+import time
+import multiprocessing
 import streamlit as st
 import pandas as pd
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from src.components.file_handlers import handle_template_download, handle_file_upload
-from src.components.parameter_controls import create_parameter_controls
-from src.optimization.vrp import solve_vrp
+from src.components.parameter_controls import create_parameter_controls, create_paginated_dataframe
+from src.optimization.vrp import (
+    compute_vrp_matrices, check_time_window_feasibility, solve_vrp, cluster_locations, merge_vrp_results
+)
+from src.optimization.speed_opt import add_optimized_speeds
 from src.utils.vrp_mapping import create_vrp_map
 
+FIRST_SOLUTION_STRATEGIES = [
+    "PARALLEL_CHEAPEST_INSERTION", "PATH_CHEAPEST_ARC", "SAVINGS",
+    "CHRISTOFIDES", "LOCAL_CHEAPEST_INSERTION"
+]
+
+@st.cache_data(show_spinner=False)
+def _compute_matrices(coords: np.ndarray):
+    """Distance and time matrices, cached on the location coordinates"""
+    return compute_vrp_matrices(coords[:, 0], coords[:, 1])
+
+@st.cache_data(show_spinner=False)
+def _screen_time_windows(coords: np.ndarray, windows: np.ndarray, num_vehicles: int):
+    """Time window screen, cached on the coordinates, both window columns and the vehicle count"""
+    _, time_matrix = _compute_matrices(coords)
+    windows_df = pd.DataFrame(windows, columns=['Time_Window_Start', 'Time_Window_End'])
+    return check_time_window_feasibility(windows_df, time_matrix, num_vehicles)
+
+@st.cache_resource
+def _solver_executor() -> ProcessPoolExecutor:
+    """Worker processes shared by all sessions, so solves run off the script thread"""
+    return ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+
+def _submit_unclustered(locations_df, distance_matrix, time_matrix, params):
+    """Submits the full VRP to the workers, once per CPU"""
+    # OR-Tools searches on a single thread, so each spare CPU runs the same
+    # search from another first solution strategy
+    strategies = [params['first_solution_strategy']] + [
+        strategy for strategy in FIRST_SOLUTION_STRATEGIES
+        if strategy != params['first_solution_strategy']
+    ]
+    return [
+        _solver_executor().submit(
+            solve_vrp,
+            locations_df,
+            distance_matrix=distance_matrix,
+            time_matrix=time_matrix,
+            **{**params, 'first_solution_strategy': strategy}
+        )
+        for strategy in strategies[:os.cpu_count() or 1]
+    ]
+
+def _solve_state(futures, clusters, params, notice=None):
+    """Session state entry for a running solve"""
+    return {
+        'futures': futures,
+        'clusters': clusters,
+        'started': time.monotonic(),
+        # Solves beyond one per CPU queue for a free worker
+        'time_limit': params['max_run_time_seconds'] * -(-len(futures) // (os.cpu_count() or 1)),
+        'notice': notice
+    }
+
+@st.fragment
+def _render_results(locations_df, use_capacity):
+    """Renders the Results section; reruns on its own when only its contents change"""
+    results_expander = st.expander("📊 Results", expanded=st.session_state.get('show_results', False))
+    with results_expander:
+        if locations_df is None:
+            st.warning("Please upload your data first.")
+        elif 'optimization_results' not in st.session_state:
+            st.info("Run the optimization to see results.")
+        else:
+            results = st.session_state.optimization_results
+            
+            if results['status'] == 'SUCCESS':
+                # Summary metrics
+                st.subheader("Summary")
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    st.metric("Total Distance", f"{results['total_distance']:.1f} km")
+                with col2:
+                    st.metric("Total Time", f"{results['total_time']:.1f} min")
+                with col3:
+                    st.metric("Vehicles Used", str(len(results['routes'])))
+                
+                # Route details
+                # Route details section in the Results expander
+                st.subheader("Route Details")
+                route_info = results['route_info']
+                # Format every route's metrics in one pass
+                distance_labels = np.char.mod("%.1f km", route_info['distance'])
+                time_labels = np.char.mod("%.1f min", route_info['total_time'])
+                optimized_time_labels = np.char.mod("%.1f min", route_info['optimized_time'])
+                load_labels = np.char.mod("%.1f", route_info['load'])
+                route_tabs = st.tabs([f"Route {i+1}" for i in range(len(route_info['locations']))])
+                for i, tab in enumerate(route_tabs):
+                    with tab:
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            st.metric("Distance", distance_labels[i])
+                            st.metric("Total Time", time_labels[i])
+                            st.metric("Time at Optimized Speeds", optimized_time_labels[i])
+                        with col2:
+                            if use_capacity:
+                                st.metric("Load", load_labels[i])
+                            st.write("Stops:", route_info['locations'][i])
+                
+                # Display map
+                st.subheader("Route Map")
+                map_result = create_vrp_map(
+                    locations_df,
+                    results['routes'],
+                    deck=st.session_state.get('vrp_map_deck')
+                )
+                # Later results only replace the layer data of this deck
+                st.session_state.vrp_map_deck = map_result['deck']
+                st.pydeck_chart(map_result['deck'])
+                
+                # Map legend, sent as a single element
+                st.subheader("Legend")
+                legend_items = [
+                    f'<span style="color: rgb{tuple(color)};">■</span> Vehicle {i+1}'
+                    for i, color in enumerate(map_result['vehicle_colors'])
+                ]
+                legend_items.append('<span style="color: rgb(200, 30, 0);">●</span> Delivery Location')
+                legend_items.append('<span style="color: rgb(0, 255, 0);">●</span> Depot')
+                st.markdown("<br>".join(legend_items), unsafe_allow_html=True)
+            else:
+                st.error(f"Optimization failed with status: {results['status']}")
+
 def vrp_page():
     st.title("Vehicle Routing Optimization")
 
@@ -48,6 +175,7 @@ def vrp_page():
         
         st.subheader("2. Upload Data")
         dfs, error = handle_file_upload(["locations"])
+        locations_df = None
         
         if error:
             st.error(error)
@@ -57,7 +185,7 @@ def vrp_page():
             st.success("Data uploaded successfully! Review your data in the table below:")
             
             locations_df = dfs["locations"]
-            st.dataframe(locations_df)
+            create_paginated_dataframe(locations_df, "locations_page", page_size=200)
 
     # Parameters Section
     parameters_expander = st.expander("⚙️ Parameters", expanded=dfs is not None)
@@ -105,96 +233,143 @@ def vrp_page():
                         "max_run_time_seconds": (10, 300, 10)
                     }
                 )
+                solver_params['first_solution_strategy'] = st.selectbox(
+                    "First solution strategy",
+                    FIRST_SOLUTION_STRATEGIES
+                )
+                solver_params['local_search_metaheuristic'] = st.selectbox(
+                    "Metaheuristic",
+                    ["GUIDED_LOCAL_SEARCH", "TABU_SEARCH", "SIMULATED_ANNEALING", "GREEDY_DESCENT"]
+                )
+                
+                st.markdown("""
+                - **First Solution Strategy**: Heuristic used to build the initial routes (with more than one CPU, the other strategies are also tried in parallel and the best routes kept)
+                - **Metaheuristic**: Local search used to improve the routes until the time limit (Greedy Descent stops at the first local optimum)
+                """)
+                
+                use_clustering = st.checkbox(
+                    "Cluster locations before solving",
+                    help="Split the locations into one geographic cluster per vehicle and route each "
+                         "cluster separately. Much faster for large instances, but routes may be longer."
+                )
             
             params = {**vehicle_params, **solver_params}
             
-            # Check if time windows exist in data
-            has_time_windows = not (locations_df['Time_Window_Start'].isna().all() or 
-                                  locations_df['Time_Window_End'].isna().all())
+            # Check if time windows exist in data, scanning both columns once
+            missing_windows = np.isnan(
+                locations_df[['Time_Window_Start', 'Time_Window_End']].to_numpy(dtype=float)
+            )
+            has_time_windows = not missing_windows.all(axis=0).any()
             
             if has_time_windows:
                 st.info("Time window constraints detected in the data and will be used in the optimization.")
             else:
                 st.info("No time window constraints found in the data.")
             
+            # Screen the time windows the solver will use, so an infeasible model is reported
+            # immediately instead of after the full time limit
+            infeasible = False
+            if not missing_windows.any():
+                unreachable, conflicts = _screen_time_windows(
+                    locations_df[['Latitude', 'Longitude']].to_numpy(),
+                    locations_df[['Time_Window_Start', 'Time_Window_End']].to_numpy(dtype=float),
+                    params['num_vehicles']
+                )
+                location_ids = locations_df['Location_ID'].to_numpy()
+                if unreachable:
+                    st.error("These locations cannot be reached within their time windows: " +
+                             ", ".join(str(location_ids[i]) for i in unreachable))
+                if conflicts:
+                    st.error("These pairs of locations cannot be served by the same vehicle: " +
+                             ", ".join(f"({location_ids[i]}, {location_ids[j]})" for i, j in conflicts))
+                infeasible = bool(unreachable or conflicts)
+            
             # Run optimization button
-            if st.button("Run Optimization", type="primary"):
-                with st.spinner("Optimizing routes..."):
-                    try:
-                        results = solve_vrp(
-                            locations_df,
-                            **params
+            if st.button("Run Optimization", type="primary", disabled=infeasible):
+                # Parameter changes reuse the matrices while the coordinates are unchanged
+                distance_matrix, time_matrix = _compute_matrices(
+                    locations_df[['Latitude', 'Longitude']].to_numpy()
+                )
+                if use_clustering:
+                    # One single vehicle VRP per cluster, solved in parallel
+                    clusters = cluster_locations(locations_df, params['num_vehicles'])
+                    futures = [
+                        _solver_executor().submit(
+                            solve_vrp,
+                            locations_df.iloc[positions],
+                            distance_matrix=distance_matrix[np.ix_(positions, positions)],
+                            time_matrix=time_matrix[np.ix_(positions, positions)],
+                            **{**params, 'num_vehicles': 1}
                         )
-                        
-                        # Store results in session state
-                        st.session_state.optimization_results = results
-                        # Force the results expander to open
-                        st.session_state.show_results = True
-                        st.rerun()
-                    except Exception as e:
-                        st.error(f"Optimization failed: {str(e)}")
-
-    # Results Section
-    results_expander = st.expander("📊 Results", expanded=st.session_state.get('show_results', False))
-    with results_expander:
-        if dfs is None:
-            st.warning("Please upload your data first.")
-        elif 'optimization_results' not in st.session_state:
-            st.info("Run the optimization to see results.")
-        else:
-            results = st.session_state.optimization_results
+                        for positions in clusters
+                    ]
+                else:
+                    clusters = None
+                    futures = _submit_unclustered(locations_df, distance_matrix, time_matrix, params)
+                # The solve is kept in session state, so a rerun triggered while it is
+                # running picks the progress display back up instead of losing the result
+                st.session_state.vrp_solve = _solve_state(futures, clusters, params)
             
-            if results['status'] == 'SUCCESS':
-                # Summary metrics
-                st.subheader("Summary")
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("Total Distance", f"{results['total_distance']:.1f} km")
-                with col2:
-                    st.metric("Total Time", f"{results['total_time']:.1f} min")
-                with col3:
-                    st.metric("Vehicles Used", str(len(results['routes'])))
-                
-                # Route details
-                # Route details section in the Results expander
-                st.subheader("Route Details")
-                route_tabs = st.tabs([f"Route {i+1}" for i in range(len(results['route_info']))])
-                for i, (tab, route_info) in enumerate(zip(route_tabs, results['route_info'])):
-                    with tab:
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            st.metric("Distance", f"{route_info['distance']:.1f} km")
-                            st.metric("Total Time", f"{route_info['total_time']:.1f} min")
-                        with col2:
-                            if params['use_capacity']:
-                                st.metric("Load", f"{route_info['load']:.1f}")
-                            st.write("Stops:", route_info['locations'])
-                
-                # Display map
-                st.subheader("Route Map")
-                map_result = create_vrp_map(
-                    locations_df,
-                    results['routes']
-                )
-                st.pydeck_chart(map_result['deck'])
-                
-                # Map legend
-                st.subheader("Legend")
-                for i, color in enumerate(map_result['vehicle_colors']):
-                    st.markdown(
-                        f'<span style="color: rgb{tuple(color)};">■</span> Vehicle {i+1}', 
-                        unsafe_allow_html=True
+            solve = st.session_state.get('vrp_solve')
+            if solve is not None:
+                if solve['notice']:
+                    st.warning(solve['notice'])
+                progress = st.progress(0.0, text="Optimizing routes...")
+                while not all(future.done() for future in solve['futures']):
+                    elapsed = time.monotonic() - solve['started']
+                    progress.progress(
+                        min(elapsed / solve['time_limit'], 1.0),
+                        text=f"Optimizing routes... {elapsed:.0f}s of {solve['time_limit']}s"
                     )
-                st.markdown(
-                    '<span style="color: rgb(200, 30, 0);">●</span> Delivery Location', 
-                    unsafe_allow_html=True
-                )
-                st.markdown(
-                    '<span style="color: rgb(0, 255, 0);">●</span> Depot', 
-                    unsafe_allow_html=True
-                )
-            else:
-                st.error(f"Optimization failed with status: {results['status']}")
+                    time.sleep(0.5)
+                progress.empty()
+                del st.session_state.vrp_solve
+                
+                try:
+                    results = [future.result() for future in solve['futures']]
+                    if solve['clusters'] is None:
+                        # Keep the lowest cost routes found by any of the strategies
+                        solved = [result for result in results if result['status'] == 'SUCCESS']
+                        results = min(solved, key=lambda result: result['objective']) if solved else results[0]
+                    else:
+                        results = merge_vrp_results(results, solve['clusters'])
+                        if results['status'] != 'SUCCESS':
+                            location_ids = locations_df['Location_ID'].to_numpy()
+                            failed_ids = [
+                                str(location_id)
+                                for c in results['failed_clusters']
+                                for location_id in location_ids[solve['clusters'][c][1:]]
+                            ]
+                            # A cluster can hold locations one vehicle cannot serve in time, so
+                            # fall back to routing all locations together; the rerun picks it up
+                            distance_matrix, time_matrix = _compute_matrices(
+                                locations_df[['Latitude', 'Longitude']].to_numpy()
+                            )
+                            st.session_state.vrp_solve = _solve_state(
+                                _submit_unclustered(locations_df, distance_matrix, time_matrix, params),
+                                None,
+                                params,
+                                notice=f"{results['error']} (locations {', '.join(failed_ids)}); "
+                                       "solving without clustering instead."
+                            )
+                            st.rerun()
+                    if results['status'] == 'SUCCESS':
+                        # Plan the speed on each leg of the fixed routes
+                        distance_matrix, _ = _compute_matrices(
+                            locations_df[['Latitude', 'Longitude']].to_numpy()
+                        )
+                        results = add_optimized_speeds(results, locations_df, distance_matrix)
+                    
+                    # Store results in session state
+                    st.session_state.optimization_results = results
+                    # Open the results expander; the results fragment is rendered later in this run,
+                    # so it picks up the new results without a full rerun
+                    st.session_state.show_results = True
+                except Exception as e:
+                    st.error(f"Optimization failed: {str(e)}")
+
+    # Results Section (expands when optimization is complete)
+    _render_results(locations_df, dfs is not None and params['use_capacity'])
 
 if __name__ == "__main__":
     vrp_page()
\ No newline at end of file
@@ -1,78 +1,100 @@
+import sys
+import re
+import bisect
+import hashlib
+import heapq
+from collections import defaultdict
 import streamlit as st
 import asyncio
-from autogen import AssistantAgent, UserProxyAgent, GroupChat, GroupChatManager
+import httpx
+import openai
+from autogen import AssistantAgent, UserProxyAgent, GroupChat, GroupChatManager, ConversableAgent, Cache
+from autogen.agentchat.contrib.capabilities.transform_messages import TransformMessages
+from autogen.agentchat.contrib.capabilities.transforms import MessageHistoryLimiter
 import uuid
-import time
 import streamlit.components.v1 as components
 import json
 from io import BytesIO
-import pandas as pd
-
-def convert_to_dataframe(data):
-    """Convert data to DataFrame based on its type"""
-    if isinstance(data, list):
-        return pd.DataFrame(data)
-    elif isinstance(data, dict):
-        return pd.DataFrame([data])
+from openpyxl import Workbook
+if sys.platform != 'win32':
+    import uvloop
+
+# Agents end a chat by including TERMINATEX in any case; one pattern serves every check.
+# It must stand as a word, so a longer word that merely contains it does not end a chat
+TERMINATEX_PATTERN = re.compile(r'\bterminatex\b', re.IGNORECASE)
+# The strategizers agree on a model type within a few exchanges; more rounds only spend tokens
+STRATEGY_MAX_ROUNDS = 10
+
+def is_terminatex(msg):
+    """Termination check shared by the agents and managers"""
+    return TERMINATEX_PATTERN.search(msg.get("content") or "") is not None
+
+def excel_rows(data):
+    """Yields the header and rows for a nested JSON value, laid out as pandas would: a column per key
+    for a dict or a list of dicts, otherwise numbered columns with one row per list item"""
+    if isinstance(data, dict):
+        data = [data]
+    if all(isinstance(item, dict) for item in data):
+        headers = list(dict.fromkeys(key for item in data for key in item))
+        yield headers
+        for item in data:
+            yield [item.get(header) for header in headers]
     else:
-        return pd.DataFrame([{"value": data}])
+        items = [item if isinstance(item, list) else [item] for item in data]
+        width = max(map(len, items), default=0)
+        yield [str(column) for column in range(width)]
+        for item in items:
+            yield item + [None] * (width - len(item))
     
-def json_to_excel(json_data):
-    # Create a BytesIO object to store the Excel file
-    excel_buffer = BytesIO()
+def excel_value(value):
+    """Converts a JSON value to a cell value; missing values are left blank and nested values written as text"""
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if isinstance(value, (dict, list)):
+        return str(value)
+    return value
+
+def json_to_excel(data):
+    """Writes the parsed output's top-level primitive values to a Summary sheet and each nested value
+    to its own sheet, streaming rows through a write-only workbook"""
+    workbook = Workbook(write_only=True)
     
-    # Create Excel writer object
-    with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
-        # Parse JSON data
-        data = json.loads(json_data)
-        
-        # Create summary sheet with all top-level primitive values
-        summary_data = {}
-        for key, value in data.items():
-            if not isinstance(value, (dict, list)):
-                summary_data[key] = value
-        
-        if summary_data:
-            summary_df = pd.DataFrame([summary_data])
-            summary_df.to_excel(writer, sheet_name='Summary', index=False)
-        
-        # Process each key-value pair
-        for key, value in data.items():
-            if isinstance(value, (dict, list)):
-                sheet_name = key[:31]  # Excel sheet names limited to 31 chars
-                df = convert_to_dataframe(value)
-                df.to_excel(writer, sheet_name=sheet_name, index=False)
+    # Create summary sheet with all top-level primitive values
+    summary_data = {}
+    for key, value in data.items():
+        if not isinstance(value, (dict, list)):
+            summary_data[key] = value
+    
+    if summary_data:
+        summary_sheet = workbook.create_sheet('Summary')
+        summary_sheet.append(list(summary_data.keys()))
+        summary_sheet.append([excel_value(value) for value in summary_data.values()])
     
-    # Get the value of the BytesIO buffer
-    excel_buffer.seek(0)
-    return excel_buffer
+    # Process each key-value pair
+    for key, value in data.items():
+        if isinstance(value, (dict, list)):
+            sheet = workbook.create_sheet(key[:31])  # Excel sheet names limited to 31 chars
+            for row in excel_rows(value):
+                sheet.append([excel_value(cell) for cell in row])
+    
+    excel_buffer = BytesIO()
+    workbook.save(excel_buffer)
+    return excel_buffer.getvalue()
 
 # Agent System Messages
-CONSULTANT_SYSTEM_MSG = """You are a consultant with expertise in operations research. You do not write code.
-You ask the user questions to understand their problem. Ask for one piece of information at a time 
-and wait for the user to respond before asking for more information.
+CONSULTANT_SYSTEM_MSG = """You are an operations research consultant. You do not write code.
+Interview the user until you can build an optimization model of their problem. Ask for one piece of information 
+at a time and wait for the answer. The user is likely unfamiliar with operations research terms, so use plain language and be patient.
 
-The user is likely unfamiliar with operations research terminology so use layman terms and be patient 
-with the user to arrive at the information you would need to construct an optimization model to solve their problem.
+Use long, descriptive variable names that need no decoding, e.g. "volume_of_product_A_to_ship_in_time_period_1".
 
-When formulating the problem use variable names that are unambigiou and obvious to understand to any reader without needing to decode. 
-These variable names can be long and descriptive such as "volume_of_product_A_to_ship_in_time_period_1".
+Ask for the solver time limit and optimality gap; default to 10 minutes and 0.01.
 
-When gathering information:
-- Ask for solver time limit and optimality gap threshold
-- Default to 10 minutes and 0.01 if not specified
+Summary: 1. model description with descriptive variable names 2. complete tables of all input sets and parameters 
+3. solver time limit and optimality gap 4. request to confirm it is accurate
 
-Your summary should include:
-1. Detailed optimization model description with intuitive variable names
-2. Complete tables of all input sets and parameters
-3. Solver parameters (time limit, optimality gap)
-4. Request confirmation of accuracy
-
-On final confirmation, provide:
-1. Complete model description with intuitive naming
-2. Full input parameter tables
-3. A note to the user to wait while the ai team works together to provide a solution, it may take several minutes
-4. Include 'TERMINATEX' to end conversation"""
+After the user confirms: 1. complete model description 2. full input parameter tables 
+3. a note asking the user to wait while the AI team works on a solution, which may take several minutes 4. 'TERMINATEX'"""
 
 STRATEGIZER_SYSTEM_MSG = """You are an expert in operations research. You will be presented with a problem that requires optimization.q
 
@@ -94,26 +116,22 @@ When you are confident that your operations research companion has correctly ide
 respond by restating word-for-word without any trucation the original problem message followed by a succinct and assertive statement of the type of optimization model and python library that should be used to solve the problem and the word 'TERMINATEX' to end the conversation.
 """
 
-CODER_SYSTEM_MSG = """You are a coder. You do not run the code. Your only job is to write code. Do not do anything else.
+CODER_SYSTEM_MSG = """You are a coder. You only write code; you do not run it.
 
-Construct the described optimization model in python using hard-coded json data as inputs.
-Be sure you all constraints, variables, parameters, and objective functions are included in the code.
-Reread the problem description to ensure you have captured all details in the code.
+Write the described optimization model in Python with all input data hard-coded as JSON. Include every constraint, 
+variable, parameter and objective; reread the problem to be sure no detail is missing.
 
 Requirements:
-- Use the recommended python library
-- For package installation, provide Windows shell commands
-- First line of Python code should be: # filename: <filename>
-- Do not truncate any part of your code
-- Include all input data directly in code
-- Use intuitive variable names
-- Full output results printed (using print statements) in json format
-- Include all decision variables in output
-
-Important: If using PuLP, LpVariable's cannot be divided by numbers. Instead, they can be multiplied by the reciprocal of the number. You must remember this when formulating constraints or objective functions.
-
-A code critic will critique your code. Follow their recommendations while always remembering the original problem description.
-Check to make sure any changes you make don't induce problems that you previously fixed in response to the code critic.
+- Use the recommended Python library
+- Give package installation as Windows shell commands
+- First line of the code: # filename: <filename>
+- Never truncate the code
+- Use descriptive variable names
+- Print the full results as JSON, including all decision variables
+
+PuLP: an LpVariable cannot be divided by a number; multiply it by the reciprocal instead.
+
+Follow the code critic's feedback without losing sight of the original problem, and do not reintroduce problems you already fixed.
 """
 
 CODE_CRITIC_SYSTEM_MSG = """You provide feedback on code alignment with problem description.
@@ -134,6 +152,36 @@ You and you alone are responsible for ensuring that the problem description is a
 Read all fo the above again.
 """
 
+PROCEED_MSG = "User, proceed with running the code."
+
+# The code critic's review is split between two critics that run in parallel
+FORMULATION_CRITIC_SYSTEM_MSG = """You provide feedback on code alignment with problem description.
+You are responsible for ensuring that the problem description is accurately and completely captured in the code.
+
+- Specify required changes if code doesn't match requirements
+- Explicitly state needed modifications
+- Only give feedback if a change is required. Do not include feedback on what is 'good' or 'correct'.
+- Only give feedback if the code is incorrect. Do not provide feedback on code quality or clarity.
+- Do not ask for or insist on knowing any additional information about the problem
+- Do not review how the code uses its optimization library; another critic does that
+- If the coder responds to you without any changes to their code, then rephrasing your feedback.
+- Double check to make sure every detail of the problem is captured in the code. If the problem is not fully captured, provide feedback on what is missing.
+- If the code is acceptable, then say nothing except "User, proceed with running the code."
+"""
+
+LIBRARY_CRITIC_SYSTEM_MSG = """You provide feedback on how code uses its optimization library.
+You are responsible for ensuring that the code will run and report its solution correctly.
+
+- Specify required changes if the code misuses the library
+- Explicitly state needed modifications
+- Only give feedback if a change is required. Do not include feedback on what is 'good' or 'correct'.
+- Do not review whether the model captures the problem description; another critic does that
+- If the code uses PuLP, remember that LpVariable's cannot be divided by numbers. However, they can be multiplied by the reciprocal of the number.
+  For example, "variable_a / 3" can instead be written as "variable_a * (1/3)". Even though 1/3 is a division operation, because it is in parentheses, it is a multiplication operation with regard to the LpVariable.
+- Verify code will have intended outcome (e.g. verify the sense of the optimization is correct according to library documentation, verify the code will run without errors, verify the code will output the solution correctly, verify the printed output is correct according to library documentation)
+- If the code is acceptable, then say nothing except "User, proceed with running the code."
+"""
+
 INITIAL_MSG = """I need to optimize something. Consultant, I will begin conversing with you, and when you fully understand my problem then the coder can begin writing the model. 
                 Reply to this message with 'Welcome! I am your optimization consultant. I will be your liaison to translate 
                 your problem into a mathematical model. After I have a clear understanding of your problem, 
@@ -153,9 +201,57 @@ CHECKER_MSG = """Only reply when the code runs successfully without errors, or a
         If the code fails after 4 attempts then reply with 'Unfortunately our team struggled to get our code to run successfully. 
         This could be caused by a misunderstanding of the problem or system dependency issues. Please try again later. TERMINATEX'"""
 
+# No spinner: it would be the first element of the page, and st.set_page_config must come first
+@st.cache_resource(show_spinner=False)
+def install_event_loop_policy():
+    """Switches asyncio to uvloop once per server process; uvloop does not support Windows"""
+    if sys.platform != 'win32':
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+install_event_loop_policy()
+
+class SharedHttpClient(httpx.Client):
+    """HTTP client that agents share; AutoGen deep copies llm_config, so copies return the same client"""
+    def __deepcopy__(self, memo):
+        return self
+
+@st.cache_resource
+def shared_http_client():
+    """One pooled HTTP/2 client for the OpenAI requests of every agent, so connections are reused"""
+    return SharedHttpClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=16, max_keepalive_connections=16)
+    )
+
+@st.cache_resource
+def llm_response_cache():
+    """AutoGen's disk cache of LLM responses, opened once per server process. It is the cache AutoGen
+    otherwise opens for every request, so earlier responses are still found"""
+    return Cache.disk(cache_seed=41, cache_path_root=".cache")
+
+def session_async_client(api_key):
+    """Async OpenAI client for streamed replies; its connections belong to the session's event loop,
+    so it is kept per session rather than shared"""
+    client = st.session_state.get('async_client')
+    if client is None or client.api_key != api_key:
+        client = openai.AsyncOpenAI(
+            api_key=api_key,
+            http_client=httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_connections=16, max_keepalive_connections=16)
+            )
+        )
+        st.session_state.async_client = client
+    return client
+
 # Initialize session state for storing agents and messages
 if 'messages' not in st.session_state:
     st.session_state.messages = []
+if 'by_role' not in st.session_state:
+    # Positions in messages of each role's messages, in order
+    st.session_state.by_role = defaultdict(list)
+    for position, message in enumerate(st.session_state.messages):
+        st.session_state.by_role[message["role"]].append(position)
 if 'in_progress' not in st.session_state:
     st.session_state.in_progress = False
 if 'agents' not in st.session_state:
@@ -164,14 +260,16 @@ if 'manager' not in st.session_state:
     st.session_state.manager = None
 if 'printed_messages' not in st.session_state:
     st.session_state.printed_messages = []
-if 'latest_update_time' not in st.session_state:
-    st.session_state.latest_update_time = time.time()
 if 'chat_id' not in st.session_state:
     st.session_state.chat_id = 1
 if 'loop' not in st.session_state:
     st.session_state.loop = None
-if 'output_json' not in st.session_state:
-    st.session_state.output_json = None
+if 'output' not in st.session_state:
+    # The team's output, parsed once when the checker returns it, and its Excel export
+    st.session_state.output = None
+    st.session_state.output_excel = None
+# Number of messages drawn in this run; a rerun starts from an empty page
+st.session_state.rendered_upto = 0
 
 # Set page config to use full height
 st.set_page_config(initial_sidebar_state="expanded")
@@ -196,11 +294,18 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 st.write("""# AutoGen Chat Agents""")
-with open("instructions.md", "r") as f:
-    instructions = f.read()
+@st.cache_data(show_spinner=False)
+def load_instructions():
+    """Reads the instructions once per server process instead of on every rerun"""
+    with open("instructions.md", "r") as f:
+        return f.read()
+
+instructions = load_instructions()
 with st.expander("📚 Instructions & Examples", expanded=False):
     st.markdown(instructions)
 chat_container = st.container()
+# Agents built in an earlier run call that run's functions, so they find this run's container here
+st.session_state.chat_container = chat_container
 
 selected_model = None
 selected_key = None
@@ -210,53 +315,316 @@ with st.sidebar:
     selected_model = st.selectbox("Model", ['gpt-4o', 'gpt-4o-mini'], index=1)
     selected_key = st.text_input("API Key", type="password")
 
+def add_message(message):
+    """Appends a chat message and indexes its position by role"""
+    st.session_state.by_role[message["role"]].append(len(st.session_state.messages))
+    st.session_state.messages.append(message)
+
+def messages_of(roles, start=0):
+    """Yields the messages of the given roles from position start on, in conversation order,
+    without scanning the messages of other roles"""
+    by_role = st.session_state.by_role
+    positions = heapq.merge(*(by_role[role][bisect.bisect_left(by_role[role], start):] for role in roles))
+    for position in positions:
+        yield st.session_state.messages[position]
+
+def render_new_messages(roles):
+    """Draws the messages of the given roles that were added since the last call in this run"""
+    with st.session_state.chat_container:
+        for message in messages_of(roles, st.session_state.rendered_upto):
+            with st.chat_message(message["role"]):
+                st.markdown(message["content"])
+    st.session_state.rendered_upto = len(st.session_state.messages)
+
+async def drain_ui(queue, batch_size=16):
+    """Redraws the chat once per batch of sent messages, batching those that arrive within 50 ms
+    of each other, so agents never wait on the UI"""
+    while True:
+        batch = [await queue.get()]
+        while len(batch) < batch_size:
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout=0.05))
+            except asyncio.TimeoutError:
+                break
+        render_new_messages(["Consultant", "user"])
+
+async def with_ui_drain(chat):
+    """Runs a chat while drain_ui draws its messages, then draws any it had not reached"""
+    drain = asyncio.create_task(drain_ui(st.session_state.ui_queue))
+    try:
+        await chat
+    finally:
+        drain.cancel()
+        render_new_messages(["Consultant", "user"])
+
 class TrackableGroupChatManager(GroupChatManager):
         def a_receive(self, message, sender, request_reply = None, silent = False):
             if len(st.session_state.messages) >=  max_rounds:
-                for message in st.session_state.messages:
-                    if message.get("role") == "Consultant" or message.get("role") == "Checker":
-                        with st.chat_message(message["role"]):
-                            st.markdown(message["content"])
+                if st.session_state.rendered_upto < len(st.session_state.messages):
+                    render_new_messages(["Consultant", "Checker"])
+                    with st.session_state.chat_container:
                         with st.chat_message("System"):
                             st.markdown("The maximum rounds have been reached before a solution was found. Please try again or increase the maximum rounds.")
             elif sender.name == 'Consultant' or sender.name == 'Checker' or sender.name == "OperationsResearcherCritic":
-                if st.session_state.latest_update_time < time.time() - 1:
-                    st.session_state.latest_update_time=time.time()
-                    for message in st.session_state.messages:
-                        if message.get("role") in ["Consultant", "user"]:
-                            with st.chat_message(message["role"]):
-                                st.markdown(message["content"])
-                    if "terminatex" in st.session_state.messages[-1]["content"].lower():
-                        if st.session_state.chat_id == 3:
-                            # get json part of last message in st.sessionstate.messages
-                            if st.session_state.messages[-1]["content"][0].strip() == "{":
-                                st.session_state.output_json = st.session_state.messages[-1]["content"].split("TERMINATEX")[0].strip()
-                        st.session_state.chat_id += 1
-                        st.session_state.in_progress = False
-                        print("Terminating chat")
-                        if st.session_state.chat_id==3 or st.session_state.chat_id==2:
-                            with chat_container:
-                                if message.get("role") in ["Consultant", "user"]:
-                                    for message in st.session_state.messages:
-                                        with st.chat_message(message["role"]):
-                                            st.markdown(message["content"])
-                            st.rerun()
+                if is_terminatex(st.session_state.messages[-1]):
+                    if st.session_state.chat_id == 3:
+                        # get json part of last message in st.sessionstate.messages
+                        content = st.session_state.messages[-1]["content"]
+                        if content.lstrip().startswith("{"):
+                            try:
+                                st.session_state.output = json.loads(TERMINATEX_PATTERN.split(content, 1)[0])
+                            except json.JSONDecodeError:
+                                # The checker's reply is shown instead of a download
+                                print("The output is not valid JSON")
+                    st.session_state.chat_id += 1
+                    st.session_state.in_progress = False
+                    print("Terminating chat")
             return super().a_receive(message, sender, request_reply, silent)
 
 class TrackableAssistantAgent(AssistantAgent):
     def a_send(self,message, recipient, request_reply, silent):
         new_message = {"role": self.name, "content": message, "id": uuid.uuid4()}
-        st.session_state.messages.append(new_message)
+        add_message(new_message)
+        st.session_state.ui_queue.put_nowait(new_message)
         print(f"Sending {self.name} message: {new_message}")
         print(f"Number of rounds completed {len(st.session_state.messages)}" )
         return super().a_send(message, recipient, request_reply, silent)
+def reply_text(reply):
+    """Returns the text of a generated reply, which AutoGen may give as a string or a message dict"""
+    return reply if isinstance(reply, str) else (reply or {}).get("content") or ""
+
+class CompositeCriticAgent(TrackableAssistantAgent):
+    """Critic whose review is written by several critics in parallel, each checking one aspect of the code"""
+    def __init__(self, *args, critics, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.critics = critics
+        self.replace_reply_func(ConversableAgent.a_generate_oai_reply, CompositeCriticAgent.a_gather_reviews)
+
+    async def a_gather_reviews(self, messages=None, sender=None, config=None):
+        """Asks every critic at once and joins their requested changes, or lets the code run if none have any"""
+        if messages is None:
+            messages = self._oai_messages[sender]
+        replies = await asyncio.gather(*(critic.a_generate_reply(messages=messages) for critic in self.critics))
+        reviews = [text for text in map(reply_text, replies) if PROCEED_MSG not in text]
+        return True, "\n\n".join(reviews) if reviews else PROCEED_MSG
+
+class StreamingAssistantAgent(TrackableAssistantAgent):
+    """Assistant whose replies are streamed into the chat container as they are generated"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replace_reply_func(ConversableAgent.a_generate_oai_reply, StreamingAssistantAgent.a_stream_oai_reply)
+
+    async def a_stream_oai_reply(self, messages=None, sender=None, config=None):
+        """Generates the reply with a streamed completion, rendering each delta as it arrives"""
+        if messages is None:
+            messages = self._oai_messages[sender]
+        render_new_messages(["Consultant", "user"])
+        llm = self.llm_config["config_list"][0]
+        stream = await session_async_client(llm["api_key"]).chat.completions.create(
+            model=llm["model"],
+            messages=self._oai_system_message + messages,
+            prompt_cache_key=llm["prompt_cache_key"],
+            stream=True
+        )
+        with st.session_state.chat_container:
+            placeholder = st.chat_message(self.name).empty()
+        content = ""
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                content += chunk.choices[0].delta.content
+                placeholder.markdown(content)
+        return True, content
+
+    def a_send(self, message, recipient, request_reply = None, silent = False):
+        sent = super().a_send(message, recipient, request_reply, silent)
+        # The streamed placeholder already shows this message
+        st.session_state.rendered_upto = len(st.session_state.messages)
+        return sent
 class TrackableUserProxyAgent(UserProxyAgent):
     def a_send(self,message,recipient,request_reply = None,silent = False):
         print(f"Sending {self.name} message: {message}")
         print(f"Number of rounds completed {len(st.session_state.messages)}" )
         return super().a_send(message, recipient, request_reply, silent)
-
-
+class CodeRunningUserProxyAgent(TrackableUserProxyAgent):
+    """User proxy that runs the coder's code in a worker thread, so a long solve does not block
+    the event loop that the other agents and the chat's UI updates run on"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replace_reply_func(
+            ConversableAgent.generate_code_execution_reply,
+            CodeRunningUserProxyAgent.a_generate_code_execution_reply
+        )
+
+    async def a_generate_code_execution_reply(self, messages=None, sender=None, config=None):
+        """Runs generate_code_execution_reply in a worker thread"""
+        return await asyncio.to_thread(self.generate_code_execution_reply, messages, sender, config)
+
+def with_prompt_cache_key(llm_config, key):
+    """Returns llm_config with an OpenAI prompt_cache_key, so requests that open with the same
+    system message are routed to the same prompt cache and their shared prefix is billed as cached"""
+    return {
+        **llm_config,
+        "config_list": [{**config, "prompt_cache_key": key} for config in llm_config["config_list"]]
+    }
+
+def make_assistant(name, system_message, llm_config, agent_class=TrackableAssistantAgent, **kwargs):
+    """Builds an assistant with the settings every assistant on this page shares"""
+    agent = agent_class(
+        name=name,
+        system_message=system_message,
+        llm_config=with_prompt_cache_key(llm_config, name),
+        human_input_mode="NEVER",
+        is_termination_msg=is_terminatex,
+        **kwargs
+    )
+    agent.client_cache = llm_response_cache()
+    return agent
+
+def limit_history(*agents, max_messages=12):
+    """Sends the agents only the message that opened their chat and its latest messages, so prompts
+    stop growing with the number of rounds"""
+    history_limit = TransformMessages(
+        transforms=[MessageHistoryLimiter(max_messages=max_messages, keep_first_message=True)],
+        verbose=False
+    )
+    for agent in agents:
+        history_limit.add_to_agent(agent)
+
+def make_manager(groupchat, llm_config):
+    """Builds the manager of a chat's group chat"""
+    manager = TrackableGroupChatManager(
+        groupchat=groupchat,
+        llm_config=llm_config,
+        is_termination_msg=is_terminatex,
+    )
+    manager.client_cache = llm_response_cache()
+    return manager
+
+async def draft_code(problem, llm_config):
+    """Drafts the model code speculatively, while the strategizers are still choosing the model type"""
+    draft_coder = make_assistant("Coder", CODER_SYSTEM_MSG, llm_config, agent_class=AssistantAgent)
+    reply = await draft_coder.a_generate_reply(messages=[{"role": "user", "content": problem}])
+    return reply_text(reply)
+
+def take_code_draft(problem):
+    """Returns the speculative code draft as a note for the coder, or an empty string if it is
+    unfinished or imports none of the libraries named in the strategizers' recommendation"""
+    task = st.session_state.pop('code_draft', None)
+    if task is None:
+        return ""
+    if not task.done():
+        task.cancel()
+        return ""
+    if task.cancelled() or task.exception() is not None:
+        return ""
+    draft = task.result()
+    libraries = set(re.findall(r'^\s*(?:from|import)\s+(\w+)', draft, re.MULTILINE)) - sys.stdlib_module_names
+    if not any(library.lower() in problem.lower() for library in libraries):
+        return ""
+    # The draft is passed without its code fences, so the user proxy does not run it
+    return ("\n\nA draft of the code was written while the model type was being chosen. "
+            "Reuse it where it fits the problem:\n" + re.sub(r'```\w*', '', draft))
+
+def build_chat(llm_config):
+    """Builds the agents and manager of the current chat and returns the message that opens it"""
+    if st.session_state.chat_id == 1:
+        print("Creating agents for chat 1")
+        initial_msg = INITIAL_MSG
+
+        consultant = make_assistant("Consultant", CONSULTANT_SYSTEM_MSG, llm_config, agent_class=StreamingAssistantAgent)
+        user_proxy = TrackableUserProxyAgent(
+                name="user",
+                system_message="A human.",  
+                human_input_mode="ALWAYS",
+                code_execution_config=False, 
+                llm_config=llm_config)
+        
+        groupchat1 = GroupChat(
+            agents=[consultant, user_proxy],
+            messages=[],
+            max_round=max_rounds,
+            speaker_transitions_type="allowed",
+            allowed_or_disallowed_speaker_transitions={
+                consultant: [user_proxy],
+                user_proxy: [consultant],
+            }
+        )
+    
+        st.session_state.manager = make_manager(groupchat1, llm_config)
+        st.session_state.agents = (consultant, user_proxy,  None, None, None, None, None)
+    elif st.session_state.chat_id == 2:
+        print("Creating agents for chat 2")
+        initial_msg = TERMINATEX_PATTERN.sub('', st.session_state.messages[-1]["content"])
+        
+        user_proxy = TrackableUserProxyAgent(
+            name="User_proxy",
+            system_message="A human.",
+            human_input_mode="NEVER",
+            is_termination_msg=is_terminatex,
+                code_execution_config=False, 
+            # silent = True
+        )
+
+        strategizer = make_assistant("OperationsResearcher", STRATEGIZER_SYSTEM_MSG, llm_config)
+        
+        strategizer_critic = make_assistant("OperationsResearcherCritic", STRATEGIZER_CRITIC_SYSTEM_MSG, llm_config)
+        limit_history(strategizer, strategizer_critic)
+
+        groupchat2 = GroupChat(
+            agents=[strategizer, strategizer_critic, user_proxy],
+            messages=[],
+            max_round=max(0,min(STRATEGY_MAX_ROUNDS, max_rounds-len(st.session_state.messages)))
+        )
+        st.session_state.manager = make_manager(groupchat2, llm_config)
+        st.session_state.agents = (None, user_proxy, None,  None, None, strategizer, strategizer_critic)
+    elif st.session_state.chat_id == 3:
+        print("Creating agents for chat 3")
+        initial_msg = TERMINATEX_PATTERN.sub('', st.session_state.messages[-1]["content"])
+        initial_msg += take_code_draft(initial_msg)
+
+        user_proxy = CodeRunningUserProxyAgent(
+            name="User_proxy",
+            system_message="A human. Only run code provided by the coder.",
+            human_input_mode="NEVER",
+            code_execution_config={
+                "last_n_messages": 2,
+                "work_dir": "groupchat",
+                "use_docker": False,
+            },
+            is_termination_msg=is_terminatex,
+            # silent = True
+        )
+        
+        coder = make_assistant("Coder", CODER_SYSTEM_MSG, llm_config)
+        
+        code_critic = make_assistant(
+            "CodeCritic",
+            CODE_CRITIC_SYSTEM_MSG,
+            llm_config,
+            agent_class=CompositeCriticAgent,
+            critics=[
+                make_assistant("FormulationCritic", FORMULATION_CRITIC_SYSTEM_MSG, llm_config, agent_class=AssistantAgent),
+                make_assistant("LibraryCritic", LIBRARY_CRITIC_SYSTEM_MSG, llm_config, agent_class=AssistantAgent)
+            ]
+        )
+        
+        checker = make_assistant("Checker", CHECKER_MSG, llm_config)
+        limit_history(coder, code_critic, checker)
+
+        groupchat3 = GroupChat(
+            agents=[coder, user_proxy, checker, code_critic],
+            messages=[],
+            max_round=max(0,max_rounds-len(st.session_state.messages)),
+            speaker_transitions_type="allowed",
+            allowed_or_disallowed_speaker_transitions={
+                coder: [code_critic],
+                code_critic: [coder, user_proxy],
+                user_proxy: [coder, checker],
+            }
+        )
+        st.session_state.manager = make_manager(groupchat3, llm_config)
+        st.session_state.agents = (None, user_proxy, coder,  checker, code_critic, None, None)
+    return initial_msg
 
 with st.container():
     if not selected_key or not selected_model:
@@ -267,171 +635,37 @@ with st.container():
         llm_config = {"config_list": [
                         {
                         "model": selected_model,
-                        "api_key": selected_key
+                        "api_key": selected_key,
+                        "http_client": shared_http_client()
                         }
                     ]
                  }
-        if st.session_state.in_progress == False:
-            if st.session_state.chat_id == 1:
-                print("Creating agents for chat 1")
-                INITIAL_MSG = """I need to optimize something. Consultant, I will begin conversing with you, and when you fully understand my problem then the coder can begin writing the model. 
-                Reply to this message with 'Welcome! I am your optimization consultant. I will be your liaison to translate 
-                your problem into a mathematical model. After I have a clear understanding of your problem, 
-                I will summarize it and work with my team in the backend to provide a solution.
-                Let's get started! Please describe, in as much detail as possible, the problem you are trying to solve.'"""
-
-                consultant = TrackableAssistantAgent(
-                        name="Consultant", llm_config=llm_config, 
-                        system_message=CONSULTANT_SYSTEM_MSG,          
-                        human_input_mode="NEVER",
-                        is_termination_msg=lambda msg: "terminatex" in msg["content"].lower()
-                        )
-                user_proxy = TrackableUserProxyAgent(
-                        name="user",
-                        system_message="A human.",  
-                        human_input_mode="ALWAYS",
-                        code_execution_config=False, 
-                        llm_config=llm_config)
-                
-                groupchat1 = GroupChat(
-                    agents=[consultant, user_proxy],
-                    messages=[],
-                    max_round=max_rounds,
-                    speaker_transitions_type="allowed",
-                    allowed_or_disallowed_speaker_transitions={
-                        consultant: [user_proxy],
-                        user_proxy: [consultant],
-                    }
-                )
-            
-                st.session_state.manager = TrackableGroupChatManager(
-                    groupchat=groupchat1,
-                    llm_config=llm_config,
-                    is_termination_msg=lambda msg: "terminatex" in msg["content"].lower(),
-                )
-                st.session_state.agents = (consultant, user_proxy,  None, None, None, None, None)
-            elif st.session_state.chat_id == 2:
-                print("Creating agents for chat 2")
-                st.session_state.loop.close()
-                INITIAL_MSG = st.session_state.messages[-1]["content"].replace('TERMINATEX', '').replace('terminatex', '').replace('Terminatex', '') 
-                
-                user_proxy = TrackableUserProxyAgent(
-                    name="User_proxy",
-                    system_message="A human.",
-                    human_input_mode="NEVER",
-                    is_termination_msg=lambda msg: "terminatex" in msg["content"].lower(),
-                        code_execution_config=False, 
-                    # silent = True
-                )
-
-                strategizer = TrackableAssistantAgent(
-                    name="OperationsResearcher",
-                    system_message=STRATEGIZER_SYSTEM_MSG,
-                    llm_config=llm_config,
-                    human_input_mode="NEVER",
-                    is_termination_msg=lambda msg: "terminatex" in msg["content"].lower(),
-                    # silent = True
-                )
-                
-                strategizer_critic = TrackableAssistantAgent(
-                    name="OperationsResearcherCritic",
-                    system_message=STRATEGIZER_CRITIC_SYSTEM_MSG,
-                    llm_config=llm_config,
-                    human_input_mode="NEVER",
-                    is_termination_msg=lambda msg: "terminatex" in msg["content"].lower(),
-                    # silent = True
-                )
-
-                groupchat2 = GroupChat(
-                    agents=[strategizer, strategizer_critic, user_proxy],
-                    messages=[],
-                    max_round=max(0,max_rounds-len(st.session_state.messages))
-                )
-                st.session_state.manager = TrackableGroupChatManager(
-                    groupchat=groupchat2,
-                    llm_config=llm_config,
-                    is_termination_msg=lambda msg: "terminatex" in msg["content"].lower(),
-                )
-                st.session_state.agents = (None, user_proxy, None,  None, None, strategizer, strategizer_critic)
-            elif st.session_state.chat_id == 3:
-                print("Creating agents for chat 3")
-                st.session_state.loop.close()
-                INITIAL_MSG = st.session_state.messages[-1]["content"].replace('TERMINATEX', '').replace('terminatex', '').replace('Terminatex', '') 
-
-                user_proxy = TrackableUserProxyAgent(
-                    name="User_proxy",
-                    system_message="A human. Only run code provided by the coder.",
-                    human_input_mode="NEVER",
-                    code_execution_config={
-                        "last_n_messages": 2,
-                        "work_dir": "groupchat",
-                        "use_docker": False,
-                    },
-                    is_termination_msg=lambda msg: "terminatex" in msg["content"].lower(),
-                    # silent = True
-                )
-                
-                coder = TrackableAssistantAgent(
-                    name="Coder",
-                    system_message=CODER_SYSTEM_MSG,
-                    llm_config=llm_config,
-                    human_input_mode="NEVER",
-                    is_termination_msg=lambda msg: "terminatex" in msg["content"].lower(),
-                    # silent = True
-                )
-                
-                code_critic = TrackableAssistantAgent(
-                    name="CodeCritic",
-                    system_message=CODE_CRITIC_SYSTEM_MSG,
-                    llm_config=llm_config,
-                    human_input_mode="NEVER",
-                    is_termination_msg=lambda msg: "terminatex" in msg["content"].lower(),
-                    # silent = True
-                )
-                
-                checker = TrackableAssistantAgent(
-                    name="Checker",
-                    system_message=CHECKER_MSG,
-                    llm_config=llm_config,
-                    human_input_mode="NEVER",
-                    is_termination_msg=lambda msg: "terminatex" in msg["content"].lower(),
-                )
-
-                groupchat3 = GroupChat(
-                    agents=[coder, user_proxy, checker, code_critic],
-                    messages=[],
-                    max_round=max(0,max_rounds-len(st.session_state.messages)),
-                    speaker_transitions_type="allowed",
-                    allowed_or_disallowed_speaker_transitions={
-                        coder: [code_critic],
-                        code_critic: [coder, user_proxy],
-                        user_proxy: [coder, checker],
-                    }
-                )
-                st.session_state.manager = TrackableGroupChatManager(
-                    groupchat=groupchat3,
-                    llm_config=llm_config,
-                    is_termination_msg=lambda msg: "terminatex" in msg["content"].lower(),
-                )
-                st.session_state.agents = (None, user_proxy, coder,  checker, code_critic, None, None)
         
-        consultant, user_proxy, coder, checker, code_critic, strategizer, strategizer_critic = st.session_state.agents
-        manager = st.session_state.manager
-        
-        # Create an event loop
-        st.session_state.loop = asyncio.new_event_loop()
+        # Reuse one event loop for the whole session, so connections opened by the agents
+        # stay alive between reruns. Streamlit runs a session's reruns one at a time, so
+        # the loop is never entered while it is already running.
+        if st.session_state.loop is None or st.session_state.loop.is_closed():
+            st.session_state.loop = asyncio.new_event_loop()
         asyncio.set_event_loop(st.session_state.loop)
+        # Sent messages are queued for drain_ui; a rerun starts a new page, so it starts a new queue
+        st.session_state.ui_queue = asyncio.Queue()
 
         async def continue_chat(user_input):
-            await manager.a_receive(message=user_input, sender=user_proxy)
+            user_proxy = st.session_state.agents[1]
+            await st.session_state.manager.a_receive(message=user_input, sender=user_proxy)
 
         async def initiate_chat():
+            user_proxy = st.session_state.agents[1]
+            if st.session_state.chat_id == 2:
+                # The coder's first draft only needs the problem summary, so it runs alongside
+                # the strategizers and is kept for chat 3 if their recommendation matches it
+                st.session_state.code_draft = asyncio.create_task(draft_code(st.session_state.initial_msg, llm_config))
             await user_proxy.a_initiate_chats(
                 [
                     {
                         "chat_id": 1,
-                        "recipient": manager,
-                        "message": INITIAL_MSG,
+                        "recipient": st.session_state.manager,
+                        "message": st.session_state.initial_msg,
                         "silent": False,
                         "summary_method": "last_msg"
                     }
@@ -439,37 +673,62 @@ with st.container():
             )
 
         user_input = st.chat_input("Type something...")
-        if not st.session_state.in_progress and st.session_state.chat_id <4:
+        if user_input:
+            # Add user input to messages
+            add_message({"role": "user", "content": user_input, "id": uuid.uuid4()})
+            # Replies are streamed below the conversation so far, so it is drawn once up front
+            render_new_messages(["Consultant", "user"])
+
+            # Run the asynchronous function within the event loop
+            st.session_state.loop.run_until_complete(with_ui_drain(continue_chat(user_input)))
+
+        # A chat that ends hands over to the next one within this run, until the consultant
+        # waits for the user or the team has finished
+        working = None
+        team_started = None
+        while not st.session_state.in_progress and st.session_state.chat_id <4:
+            # Agents are built once per chat and configuration; the key is only kept as a digest
+            config_signature = (
+                selected_model,
+                hashlib.sha256(selected_key.encode()).hexdigest(),
+                max_rounds,
+                st.session_state.chat_id
+            )
+            if st.session_state.manager is None or st.session_state.get('config_signature') != config_signature:
+                st.session_state.config_signature = config_signature
+                st.session_state.initial_msg = build_chat(llm_config)
             st.session_state.in_progress = True
-            with chat_container:
-                for message in st.session_state.messages:
-                    if message.get("role") in ["Consultant", "Checker", "user"]:
-                        with st.chat_message(message["role"]):
-                            st.markdown(message["content"])
-                if st.session_state.chat_id == 3 or st.session_state.chat_id == 2:
-                    with st.chat_message("System"):
-                        col1, col2 = st.columns([0.85, 0.15])
-                        with col1:
-                            st.markdown("A team of AI agents is working on solving this problem. This may take several minutes. When finished, they will reply with an excel output to view the results.")
-                        with col2:
-                            with st.spinner(""):
-                                 st.empty()
-
-            st.session_state.loop.run_until_complete(initiate_chat())
+            render_new_messages(["Consultant", "Checker", "user"])
+            if (st.session_state.chat_id == 3 or st.session_state.chat_id == 2) and working is None:
+                team_started = len(st.session_state.messages)
+                with chat_container:
+                    working = st.empty()
+                    with working.container():
+                        with st.chat_message("System"):
+                            col1, col2 = st.columns([0.85, 0.15])
+                            with col1:
+                                st.markdown("A team of AI agents is working on solving this problem. This may take several minutes. When finished, they will reply with an excel output to view the results.")
+                            with col2:
+                                with st.spinner(""):
+                                     st.empty()
+
+            st.session_state.loop.run_until_complete(with_ui_drain(initiate_chat()))
         if st.session_state.chat_id >= 4:
-            for message in st.session_state.messages:
-                if message.get("role") in ["Consultant","Checker", "user"]:
-                    if message.get("role") == "Checker" and not st.session_state.output_json:
-                        with st.chat_message(message["role"]):
-                            st.markdown(message["content"])
-                    elif message.get("role") != "Checker":
-                        with st.chat_message(message["role"]):
-                            st.markdown(message["content"])
-            if st.session_state.output_json:
+            if working is not None:
+                working.empty()
+            if team_started is not None:
+                # The team finished in this run, and its messages were not drawn while it worked
+                st.session_state.rendered_upto = team_started
+            # The checker's reply is only shown when it did not produce an output to download
+            roles = ["Consultant", "user"] if st.session_state.output else ["Consultant", "Checker", "user"]
+            render_new_messages(roles)
+            if st.session_state.output:
                 with st.chat_message("System"):
                     st.markdown("The AI team has finished working on the problem. You can download the output below.")
-                print(st.session_state.output_json)
-                excel_file = json_to_excel(st.session_state.output_json)
+                print(st.session_state.output)
+                if st.session_state.output_excel is None:
+                    st.session_state.output_excel = json_to_excel(st.session_state.output)
+                excel_file = st.session_state.output_excel
                 # Create download button
                 st.download_button(
                     label="Click to Download",
@@ -477,13 +736,3 @@ with st.container():
                     file_name="AI_Agent_Optimization_Output.xlsx",
                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                 )
-    if user_input:
-        # Create agents if they don't exist or if configuration changed
-        
-        
-        # Add user input to messages
-        st.session_state.messages.append({"role": "user", "content": user_input, "id": uuid.uuid4()})
-
-        # Run the asynchronous function within the event loop
-        # try:
-        st.session_state.loop.run_until_complete(continue_chat(user_input))
@@ -0,0 +1,121 @@
+import threading
+import streamlit as st
+import pandas as pd
+from typing import Dict, Optional, Tuple
+from src.optimization.facility_milp import build_facility_model, solve_facility_model, sweep_facility_locations
+from src.optimization.facility_pso import optimize_facility_locations_pso_restarts
+from src.optimization.hub_network import optimize_hub_network
+from src.utils.hashing import hash_dataframe
+
+# Solver results are persisted to disk (in ~/.streamlit/cache) so a server restart does not
+# force another long solve. Streamlit ignores ttl for persisted caches, so they are bounded by
+# max_entries only and cleared from the sidebar. Parameter dicts are passed unhashed as
+# _params and keyed by their hash_params digest.
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def cached_facility_model(
+    facilities_key: bytes,
+    customers_key: bytes,
+    distances_key: Optional[bytes],
+    _facilities_df: pd.DataFrame,
+    _customers_df: pd.DataFrame,
+    _distances_df: Optional[pd.DataFrame]
+) -> Tuple[Dict, threading.Lock]:
+    """Builds the facility MILP once per dataset, with a lock that serializes solves of the shared model"""
+    return build_facility_model(_facilities_df, _customers_df, _distances_df), threading.Lock()
+
+@st.cache_data(persist="disk", max_entries=64, show_spinner=False)
+def cached_facility_milp(
+    params_key: bytes,
+    facilities_key: bytes,
+    customers_key: bytes,
+    distances_key: Optional[bytes],
+    _facilities_df: pd.DataFrame,
+    _customers_df: pd.DataFrame,
+    _distances_df: Optional[pd.DataFrame],
+    _params: Dict,
+    _warm_start: Optional[Dict[str, float]] = None
+) -> Dict:
+    """Solves the cached facility model, cached on the input and parameter keys"""
+    # Parameter changes only change the objective, so the built model is reused
+    model, lock = cached_facility_model(
+        facilities_key,
+        customers_key,
+        distances_key,
+        _facilities_df,
+        _customers_df,
+        _distances_df
+    )
+    with lock:
+        return solve_facility_model(model, warm_start=_warm_start, **_params)
+
+@st.cache_data(persist="disk", max_entries=64, show_spinner=False)
+def cached_facility_sweep(
+    params_key: bytes,
+    facilities_key: bytes,
+    customers_key: bytes,
+    distances_key: Optional[bytes],
+    _facilities_df: pd.DataFrame,
+    _customers_df: pd.DataFrame,
+    _distances_df: Optional[pd.DataFrame],
+    sweep_param: str,
+    sweep_values: Tuple[float, ...],
+    _params: Dict
+) -> pd.DataFrame:
+    """Runs sweep_facility_locations, cached on the input keys, swept values and parameter key"""
+    return sweep_facility_locations(
+        _facilities_df,
+        _customers_df,
+        _distances_df,
+        sweep_param,
+        list(sweep_values),
+        **_params
+    )
+
+# PSO runs are quick to repeat, so their results are kept as a shared resource rather than
+# persisted: hits return the same dict without pickling or hashing its DataFrames, which
+# callers must treat as read-only
+PSO_RESULT_FIELDS = (
+    'facility_locations',
+    'assignments',
+    'history',
+    'total_cost',
+    'status',
+    'completed_iterations',
+    'total_time'
+)
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def cached_facility_pso(
+    params_key: bytes,
+    customers_key: bytes,
+    _customers_df: pd.DataFrame,
+    _params: Dict
+) -> Dict:
+    """Runs optimize_facility_locations_pso_restarts, cached on the input and parameter keys"""
+    results = optimize_facility_locations_pso_restarts(_customers_df, **_params)
+    return {field: results[field] for field in PSO_RESULT_FIELDS}
+
+@st.cache_data(persist="disk", max_entries=64, show_spinner=False)
+def cached_hub_network(
+    params_key: bytes,
+    origins_key: bytes,
+    candidate_hubs_key: bytes,
+    destinations_key: bytes,
+    demand_key: bytes,
+    _origins_df: pd.DataFrame,
+    _candidate_hubs_df: pd.DataFrame,
+    _destinations_df: pd.DataFrame,
+    _demand_df: pd.DataFrame,
+    _params: Dict,
+    _warm_start: Optional[Dict[str, float]] = None
+) -> Dict:
+    """Runs optimize_hub_network, cached on the input and parameter keys"""
+    return optimize_hub_network(
+        _origins_df,
+        _candidate_hubs_df,
+        _destinations_df,
+        _demand_df,
+        warm_start=_warm_start,
+        **_params
+    )
@@ -1,43 +1,81 @@
+import io
 import streamlit as st
 import pandas as pd
+import numpy as np
 from typing import Tuple, Optional
 
+@st.cache_data(show_spinner=False)
+def _read_template(template_path: str) -> bytes:
+    """Reads a template workbook once instead of on every rerun"""
+    with open(template_path, 'rb') as template_file:
+        return template_file.read()
+
 def handle_template_download(template_path: str, template_name: str):
     """Handles template download functionality"""
-    with open(template_path, 'rb') as template_file:
-        template_bytes = template_file.read()
-        
     st.download_button(
         label=f"Download {template_name} Template",
-        data=template_bytes,
+        data=_read_template(template_path),
         file_name=f"{template_name}.xlsx",
         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     )
 
+def _downcast_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Stores coordinates as float32 and integral demand as int32, halving their size downstream"""
+    for col in ('Latitude', 'Longitude'):
+        if col in df.columns and pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = df[col].astype(np.float32)
+            
+    # Demand columns with blanks are read as floats and left unchanged
+    if 'Demand' in df.columns and pd.api.types.is_integer_dtype(df['Demand']):
+        int32_range = np.iinfo(np.int32)
+        if df['Demand'].between(int32_range.min, int32_range.max).all():
+            df['Demand'] = df['Demand'].astype(np.int32)
+    return df
+
+@st.cache_data(show_spinner=False)
+def _parse_workbook(
+    file_bytes: bytes,
+    sheets: tuple[str, ...],
+    optional_sheets: tuple[str, ...] = ()
+) -> Tuple[Optional[dict[str, pd.DataFrame]], Optional[str]]:
+    """Parses the required and any present optional sheets of an uploaded workbook, cached on the file contents"""
+    with pd.ExcelFile(io.BytesIO(file_bytes), engine="openpyxl") as xl:
+        # Validate required sheets exist
+        missing_sheets = set(sheets) - set(xl.sheet_names)
+        if missing_sheets:
+            return None, f"Missing required sheets: {missing_sheets}"
+            
+        # Read each sheet
+        present_optional = [sheet for sheet in optional_sheets if sheet in xl.sheet_names]
+        frames = xl.parse(sheet_name=list(sheets) + present_optional)
+        return {name: _downcast_columns(df) for name, df in frames.items()}, None
+
 def handle_file_upload(
-    allowed_sheets: list[str]
+    allowed_sheets: list[str],
+    optional_sheets: Optional[list[str]] = None
 ) -> Tuple[Optional[dict[str, pd.DataFrame]], Optional[str]]:
-    """Handles file upload and validation"""
+    """Handles file upload and validation; optional sheets are included only when present"""
     uploaded_file = st.file_uploader("Upload your populated template", type=['xlsx'])
     
     if uploaded_file is not None:
+        # Reruns reuse the frames parsed for this upload, which skips copying them out of the
+        # cache and keeps their hash_dataframe digests memoized
+        upload_key = (uploaded_file.file_id, tuple(allowed_sheets), tuple(optional_sheets or ()))
+        cached = st.session_state.get('uploaded_workbook')
+        if cached is not None and cached[0] == upload_key:
+            return cached[1]
+        
         try:
-            # Read all required sheets
-            dfs = {}
-            xl = pd.ExcelFile(uploaded_file)
-            
-            # Validate required sheets exist
-            missing_sheets = set(allowed_sheets) - set(xl.sheet_names)
-            if missing_sheets:
-                return None, f"Missing required sheets: {missing_sheets}"
-                
-            # Read each sheet
-            for sheet in allowed_sheets:
-                dfs[sheet] = pd.read_excel(uploaded_file, sheet_name=sheet)
-                
-            return dfs, None
+            parsed = _parse_workbook(
+                uploaded_file.getvalue(),
+                tuple(allowed_sheets),
+                tuple(optional_sheets or ())
+            )
             
         except Exception as e:
             return None, f"Error processing file: {str(e)}"
+        
+        st.session_state.uploaded_workbook = (upload_key, parsed)
+        return parsed
             
     return None, None
\ No newline at end of file
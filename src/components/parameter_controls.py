@@ -26,4 +26,33 @@ def create_editable_dataframe(
     key: str
 ) -> pd.DataFrame:
     """Creates an editable dataframe"""
-    return st.data_editor(df, key=key)
\ No newline at end of file
+    return st.data_editor(df, key=key)
+
+def create_paginated_dataframe(
+    df: pd.DataFrame,
+    key: str,
+    page_size: int = 500
+) -> None:
+    """Displays a dataframe one page at a time, so only the visible rows are sent to the browser"""
+    n_pages = max(1, -(-len(df) // page_size))
+    if n_pages == 1:
+        st.dataframe(df)
+        return
+
+    page = st.number_input(
+        f"Page (1-{n_pages})",
+        min_value=1,
+        max_value=n_pages,
+        value=1,
+        step=1,
+        key=key
+    )
+    start = (page - 1) * page_size
+    st.dataframe(df.iloc[start:start + page_size])
+    st.caption(f"Rows {start + 1}-{min(start + page_size, len(df))} of {len(df)}")
+
+def create_cache_controls() -> None:
+    """Adds a sidebar button that clears cached data, including solver results persisted to disk"""
+    if st.sidebar.button("Clear cached results"):
+        st.cache_data.clear()
+        st.sidebar.success("Cached results cleared.")
\ No newline at end of file
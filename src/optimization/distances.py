@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+from typing import Optional
+
+# The distances sheet of the facility template is in miles
+MILES_PER_KM = 0.621371
+
+def haversine_matrix(
+    lat1: np.ndarray,
+    lon1: np.ndarray,
+    lat2: np.ndarray,
+    lon2: np.ndarray
+) -> np.ndarray:
+    """
+    Great circle distances in kilometers between two sets of points
+    Args:
+        lat1, lon1: Coordinates of the row points in degrees
+        lat2, lon2: Coordinates of the column points in degrees
+    Returns:
+        Array of shape (len(lat1), len(lat2)), float32 when the coordinates are float32
+    """
+    lat1, lon1 = np.radians(lat1)[:, None], np.radians(lon1)[:, None]
+    lat2, lon2 = np.radians(lat2)[None, :], np.radians(lon2)[None, :]
+
+    a = np.sin((lat2 - lat1)/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1)/2)**2
+    return 6371 * 2 * np.arcsin(np.sqrt(a))
+
+def facility_customer_distances(
+    facilities_df: pd.DataFrame,
+    customers_df: pd.DataFrame,
+    distances_df: Optional[pd.DataFrame] = None
+) -> np.ndarray:
+    """
+    Dense facility x customer distance matrix in miles, in the row order of the input DataFrames
+    Distances are great circle miles computed from coordinates; pairs listed in distances_df,
+    whose Distance column is in miles, override them.
+    """
+    matrix = MILES_PER_KM * haversine_matrix(
+        facilities_df['Latitude'].to_numpy(),
+        facilities_df['Longitude'].to_numpy(),
+        customers_df['Latitude'].to_numpy(),
+        customers_df['Longitude'].to_numpy()
+    )
+
+    if distances_df is not None and not distances_df.empty:
+        rows = pd.Index(facilities_df['FacilityID']).get_indexer(distances_df['FacilityID'])
+        cols = pd.Index(customers_df['CustomerID']).get_indexer(distances_df['CustomerID'])
+        known = (rows >= 0) & (cols >= 0)
+        matrix[rows[known], cols[known]] = distances_df['Distance'].to_numpy()[known]
+
+    return matrix
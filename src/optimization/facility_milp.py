@@ -1,41 +1,38 @@
+import os
+import multiprocessing
 import pulp
 import pandas as pd
-from typing import Dict, Tuple, List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Tuple, List, Optional
+from src.optimization.distances import facility_customer_distances
+from src.optimization.milp_utils import apply_warm_start, extract_warm_start, solve_with_stagnation
 
-def optimize_facility_locations(
+def build_facility_model(
     facilities_df: pd.DataFrame,
     customers_df: pd.DataFrame,
-    distances_df: pd.DataFrame,
-    mip_gap: float = 0.01,
-    max_run_time_seconds: int = 300,
-    facility_fixed_cost_multiplier: float = 1,
-    cost_per_unit_distance: float = 1
+    distances_df: Optional[pd.DataFrame] = None
 ) -> Dict:
     """
-    Optimize facility locations using Mixed Integer Linear Programming
+    Build the facility location model for a dataset
+    The objective is left to solve_facility_model, so the same model can be re-solved when only
+    the cost parameters change.
     Args:
         facilities_df: DataFrame with facility data
         customers_df: DataFrame with customer data
-        distances_df: DataFrame with distance data
-        mip_gap: Maximum MIP gap tolerance (default: 0.01 or 1%)
-        max_run_time_seconds: Maximum runtime in seconds (default: 300)
-        facility_fixed_cost_multiplier: Multiplier for facility fixed costs
-        cost_per_unit_distance: Cost per unit distance for transportation
+        distances_df: Optional DataFrame with distances in miles, overriding great circle distances
+    Returns:
+        Dictionary holding the problem, its variables and the unweighted cost expressions
     """
-    # Extract data from DataFrames
+    # Extract data from DataFrames, as arrays in the same order as the ID lists
     facilities = facilities_df['FacilityID'].tolist()
-    fixed_costs = dict(zip(facilities_df['FacilityID'], facilities_df['FixedCost']))
-    capacities = dict(zip(facilities_df['FacilityID'], facilities_df['Capacity']))
-    facility_coords = dict(zip(facilities_df['FacilityID'], 
-                             zip(facilities_df['Latitude'], facilities_df['Longitude'])))
+    fixed_costs = facilities_df['FixedCost'].to_numpy()
+    capacities = facilities_df['Capacity'].to_numpy()
     
     customers = customers_df['CustomerID'].tolist()
-    demands = dict(zip(customers_df['CustomerID'], customers_df['Demand']))
-    customer_coords = dict(zip(customers_df['CustomerID'], 
-                             zip(customers_df['Latitude'], customers_df['Longitude'])))
+    demands = customers_df['Demand'].to_numpy()
     
-    distances = {(row['FacilityID'], row['CustomerID']): row['Distance'] 
-                for _, row in distances_df.iterrows()}
+    # Facility x customer distance matrix, in the same order as the ID lists
+    distances = facility_customer_distances(facilities_df, customers_df, distances_df)
 
     # Define the problem
     prob = pulp.LpProblem("Facility_Location", pulp.LpMinimize)
@@ -47,52 +44,107 @@ def optimize_facility_locations(
                                          lowBound=0, 
                                          cat='Continuous')
     
+    # Cost components, weighted by the cost parameters when the objective is set.
+    # Expressions are built from (variable, coefficient) pairs, which skips lpSum's per-term
+    # arithmetic; the transport variables are listed facility by facility like the distance rows
+    transport_flat = [transport_vars[f][c] for f in facilities for c in customers]
+    fixed_cost = pulp.LpAffineExpression(zip([facility_vars[f] for f in facilities], fixed_costs.tolist()))
+    transport_cost = pulp.LpAffineExpression(zip(transport_flat, distances.ravel().tolist()))
+
+    # Constraints
+    n_customers = len(customers)
+    for j, demand in enumerate(demands.tolist()):
+        prob += pulp.LpAffineExpression((var, 1) for var in transport_flat[j::n_customers]) == demand
+
+    for i, f in enumerate(facilities):
+        prob += (pulp.LpAffineExpression((var, 1) for var in transport_flat[i*n_customers:(i+1)*n_customers])
+                <= capacities[i] * facility_vars[f])
+
+    return {
+        'problem': prob,
+        'facilities': facilities,
+        'customers': customers,
+        'fixed_costs': fixed_costs,
+        'capacities': capacities,
+        'facility_vars': facility_vars,
+        'transport_vars': transport_vars,
+        'fixed_cost': fixed_cost,
+        'transport_cost': transport_cost
+    }
+
+def solve_facility_model(
+    model: Dict,
+    mip_gap: float = 0.01,
+    max_run_time_seconds: int = 300,
+    facility_fixed_cost_multiplier: float = 1,
+    cost_per_unit_distance: float = 1,
+    stagnation_seconds: Optional[float] = None,
+    warm_start: Optional[Dict[str, float]] = None
+) -> Dict:
+    """
+    Set the objective on a model from build_facility_model and solve it
+    The model is modified in place, so callers sharing a model must not solve it concurrently.
+    Args:
+        model: Model returned by build_facility_model
+        mip_gap: Maximum MIP gap tolerance (default: 0.01 or 1%)
+        max_run_time_seconds: Maximum runtime in seconds (default: 300)
+        facility_fixed_cost_multiplier: Multiplier for facility fixed costs
+        cost_per_unit_distance: Cost per unit distance for transportation
+        stagnation_seconds: Stop once the best solution has not improved for this many seconds
+        warm_start: Variable values from a previous solve to use as a MIP start
+    """
+    prob = model['problem']
+    facilities = model['facilities']
+    customers = model['customers']
+    fixed_costs = model['fixed_costs']
+    capacities = model['capacities']
+    facility_vars = model['facility_vars']
+    transport_vars = model['transport_vars']
+
     # Objective function
     total_cost = (
-        pulp.lpSum([fixed_costs[f] * facility_vars[f] * facility_fixed_cost_multiplier for f in facilities]) +
-        pulp.lpSum([distances[(f, c)] * transport_vars[f][c] * cost_per_unit_distance
-                   for f in facilities for c in customers])
+        model['fixed_cost'] * facility_fixed_cost_multiplier +
+        model['transport_cost'] * cost_per_unit_distance
     )
-    prob += total_cost
+    prob.setObjective(total_cost)
 
-    # Constraints
-    for c in customers:
-        prob += pulp.lpSum([transport_vars[f][c] for f in facilities]) == demands[c]
+    # Clear any solution left on the variables by a previous solve of this model
+    for var in prob.variables():
+        var.varValue = None
 
-    for f in facilities:
-        prob += (pulp.lpSum([transport_vars[f][c] for c in customers]) 
-                <= capacities[f] * facility_vars[f])
+    # Seed the solver with the previous incumbent when one is available
+    use_warm_start = apply_warm_start(prob, warm_start)
 
-    # Create solver with custom parameters
-    solver = pulp.PULP_CBC_CMD(
+    # Solve the problem, stopping early if the incumbent stagnates
+    solve_with_stagnation(
+        prob,
+        time_limit=max_run_time_seconds,  # Maximum runtime in seconds
+        gap_rel=mip_gap,  # Relative MIP gap tolerance
+        stagnation_seconds=stagnation_seconds,
+        warm_start=use_warm_start,
         msg=False,  # Suppress solver output
-        gapRel=mip_gap,  # Relative MIP gap tolerance
-        maxSeconds=max_run_time_seconds,  # Maximum runtime in seconds
-        options=['allowableGap', str(mip_gap), 
-                'seconds', str(max_run_time_seconds)]
+        options=['allowableGap', str(mip_gap)]
     )
-
-    # Solve the problem
-    prob.solve(solver)
     
-    # Prepare results
+    # Prepare results, reading each variable's value once
+    open_facilities = [pulp.value(facility_vars[f]) == 1 for f in facilities]
     results_df = pd.DataFrame({
         'FacilityID': facilities,
-        'Open': [pulp.value(facility_vars[f]) == 1 for f in facilities],
-        'FixedCost': [fixed_costs[f] for f in facilities],
-        'Capacity': [capacities[f] for f in facilities],
-        'Selected': ['Yes' if pulp.value(facility_vars[f]) == 1 else 'No' for f in facilities]
+        'Open': open_facilities,
+        'FixedCost': fixed_costs,
+        'Capacity': capacities,
+        'Selected': ['Yes' if is_open else 'No' for is_open in open_facilities]
     })
     
     transport_results = [
         {
             'FacilityID': f,
             'CustomerID': c,
-            'TransportAmount': pulp.value(transport_vars[f][c])
+            'TransportAmount': amount
         }
         for f in facilities
         for c in customers
-        if pulp.value(transport_vars[f][c]) > 0
+        if (amount := pulp.value(transport_vars[f][c])) > 0
     ]
     transport_df = pd.DataFrame(transport_results)
     
@@ -100,5 +152,97 @@ def optimize_facility_locations(
         'results': results_df,
         'transport': transport_df,
         'total_cost': pulp.value(total_cost),
-        'status': pulp.LpStatus[prob.status]
-    }
\ No newline at end of file
+        'status': pulp.LpStatus[prob.status],
+        'warm_start': extract_warm_start(prob)
+    }
+
+def optimize_facility_locations(
+    facilities_df: pd.DataFrame,
+    customers_df: pd.DataFrame,
+    distances_df: Optional[pd.DataFrame] = None,
+    mip_gap: float = 0.01,
+    max_run_time_seconds: int = 300,
+    facility_fixed_cost_multiplier: float = 1,
+    cost_per_unit_distance: float = 1,
+    stagnation_seconds: Optional[float] = None,
+    warm_start: Optional[Dict[str, float]] = None
+) -> Dict:
+    """
+    Optimize facility locations using Mixed Integer Linear Programming
+    Args:
+        facilities_df: DataFrame with facility data
+        customers_df: DataFrame with customer data
+        distances_df: Optional DataFrame with distances in miles, overriding great circle distances
+        mip_gap: Maximum MIP gap tolerance (default: 0.01 or 1%)
+        max_run_time_seconds: Maximum runtime in seconds (default: 300)
+        facility_fixed_cost_multiplier: Multiplier for facility fixed costs
+        cost_per_unit_distance: Cost per unit distance for transportation
+        stagnation_seconds: Stop once the best solution has not improved for this many seconds
+        warm_start: Variable values from a previous solve to use as a MIP start
+    """
+    model = build_facility_model(facilities_df, customers_df, distances_df)
+    return solve_facility_model(
+        model,
+        mip_gap=mip_gap,
+        max_run_time_seconds=max_run_time_seconds,
+        facility_fixed_cost_multiplier=facility_fixed_cost_multiplier,
+        cost_per_unit_distance=cost_per_unit_distance,
+        stagnation_seconds=stagnation_seconds,
+        warm_start=warm_start
+    )
+
+def _solve_scenario(
+    facilities_df: pd.DataFrame,
+    customers_df: pd.DataFrame,
+    distances_df: Optional[pd.DataFrame],
+    params: Dict
+) -> Dict:
+    """Solves one sweep scenario in a worker process and returns its cost breakdown"""
+    results = optimize_facility_locations(facilities_df, customers_df, distances_df, **params)
+    selected = results['results'][results['results']['Open']]
+    fixed_cost = selected['FixedCost'].sum() * params.get('facility_fixed_cost_multiplier', 1)
+    total_cost = results['total_cost']
+
+    return {
+        'Status': results['status'],
+        'TotalCost': total_cost,
+        'FixedCost': fixed_cost,
+        'TransportCost': total_cost - fixed_cost if total_cost is not None else None,
+        'OpenFacilities': len(selected)
+    }
+
+def sweep_facility_locations(
+    facilities_df: pd.DataFrame,
+    customers_df: pd.DataFrame,
+    distances_df: Optional[pd.DataFrame],
+    sweep_param: str,
+    sweep_values: List[float],
+    max_workers: Optional[int] = None,
+    **params
+) -> pd.DataFrame:
+    """
+    Solve one scenario per value of a parameter, in parallel worker processes
+    Args:
+        facilities_df: DataFrame with facility data
+        customers_df: DataFrame with customer data
+        distances_df: Optional DataFrame with distance data
+        sweep_param: Name of the optimize_facility_locations parameter to vary
+        sweep_values: Values of sweep_param to solve for
+        max_workers: Number of worker processes (default: one per scenario, up to the CPU count)
+        params: Remaining optimize_facility_locations parameters, shared by all scenarios
+    Returns:
+        DataFrame with one row of costs per scenario
+    """
+    scenarios = [{**params, sweep_param: value} for value in sweep_values]
+    max_workers = max_workers or min(len(scenarios), os.cpu_count() or 1)
+
+    # Spawned workers avoid forking the threads of the Streamlit server
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [
+            executor.submit(_solve_scenario, facilities_df, customers_df, distances_df, scenario)
+            for scenario in scenarios
+        ]
+        rows = [future.result() for future in futures]
+
+    return pd.DataFrame([{sweep_param: value, **row} for value, row in zip(sweep_values, rows)])
\ No newline at end of file
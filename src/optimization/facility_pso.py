@@ -1,8 +1,16 @@
+import os
+import threading
+import multiprocessing
 import numpy as np
-from typing import Dict, List, Tuple
-import math
+from concurrent.futures import ProcessPoolExecutor
+from numba import njit, prange, set_num_threads
+from typing import Dict, List, Optional, Tuple
 import pandas as pd
 
+# Numba's default workqueue threading layer must not be entered from two threads at once,
+# and Streamlit runs each session on its own thread
+_parallel_kernel_lock = threading.Lock()
+
 def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """Calculate the great circle distance between two points on Earth"""
     R = 6371  # Earth's radius in kilometers
@@ -15,56 +23,152 @@ def haversine_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     c = 2 * np.arcsin(np.sqrt(a))
     return R * c
 
-def calculate_total_cost(
-    facility_locations: np.ndarray,
-    customers: List[str],
-    demands: Dict[str, float],
-    customer_coords: Dict[str, Tuple[float, float]],
+@njit(fastmath=True, cache=True)
+def _haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Scalar haversine distance in kilometers for use inside compiled loops"""
+    lat1, lon1, lat2, lon2 = np.radians(lat1), np.radians(lon1), np.radians(lat2), np.radians(lon2)
+    a = np.sin((lat2 - lat1)/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1)/2)**2
+    return 6371 * 2 * np.arcsin(np.sqrt(a))
+
+@njit(fastmath=True, cache=True)
+def _particle_cost(
+    facilities: np.ndarray,
+    customer_lat: np.ndarray,
+    customer_lon: np.ndarray,
+    demands: np.ndarray,
     facility_capacity: float,
     fixed_cost: float,
-    cost_per_km: float,
-    units_per_load: float
-) -> Tuple[float, Dict[str, int]]:
-    """Calculate total cost for a given solution"""
-    facility_usage = {i: 0 for i in range(len(facility_locations))}
-    total_cost = 0
+    transport_rates: np.ndarray,
+    assignments: np.ndarray
+) -> float:
+    """Calculate total cost for one particle, writing each customer's facility index into assignments"""
+    n_facilities = facilities.shape[0]
+    facility_usage = np.zeros(n_facilities)
+    total_cost = 0.0
     penalty_factor = 1000000
-    assignments = {}
 
-    for customer, demand in demands.items():
-        customer_lat, customer_lon = customer_coords[customer]
-        distances = [haversine_distance(customer_lat, customer_lon, fac_lat, fac_lon) 
-                    for fac_lat, fac_lon in facility_locations]
-        sorted_facilities = sorted(range(len(distances)), key=lambda k: distances[k])
-
-        assigned = False
-        for facility in sorted_facilities:
+    # Customers are served in order by their nearest facility with spare capacity
+    for customer in range(demands.shape[0]):
+        demand = demands[customer]
+        nearest = -1
+        nearest_distance = 0.0
+        for facility in range(n_facilities):
             if facility_usage[facility] + demand <= facility_capacity:
-                facility_usage[facility] += demand
-                distance = distances[facility]
-                loads = math.ceil(demand / units_per_load)
-                transport_cost = distance * cost_per_km * loads
-                total_cost += transport_cost
-                assignments[customer] = facility
-                assigned = True
-                break
-        
-        if not assigned:
+                distance = _haversine_km(
+                    customer_lat[customer], customer_lon[customer],
+                    facilities[facility, 0], facilities[facility, 1]
+                )
+                if nearest < 0 or distance < nearest_distance:
+                    nearest = facility
+                    nearest_distance = distance
+
+        assignments[customer] = nearest
+        if nearest < 0:
             total_cost += penalty_factor
-            assignments[customer] = None
+        else:
+            facility_usage[nearest] += demand
+            total_cost += nearest_distance * transport_rates[customer]
 
     # Add fixed costs for used facilities
-    for facility, usage in facility_usage.items():
-        if usage > 0:
+    for facility in range(n_facilities):
+        if facility_usage[facility] > 0:
             total_cost += fixed_cost
 
-    # Calculate usage standard deviation
-    usage_values = list(facility_usage.values())
-    if len(usage_values) > 1 and len(set(usage_values)) > 1:
-        usage_std = np.std(usage_values)
-        total_cost += usage_std * 100
-    
-    return float(total_cost), assignments
+    # Add usage standard deviation
+    total_cost += np.std(facility_usage) * 100
+
+    return total_cost
+
+@njit(parallel=True, fastmath=True, cache=True)
+def calculate_swarm_costs(
+    swarm: np.ndarray,
+    customer_lat: np.ndarray,
+    customer_lon: np.ndarray,
+    demands: np.ndarray,
+    facility_capacity: float,
+    fixed_cost: float,
+    transport_rates: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculate total cost for every particle of the swarm, in parallel over particles
+    Args:
+        swarm: Facility locations per particle, shape (n_particles, n_facilities, 2)
+        customer_lat: Customer latitudes, shape (n_customers,)
+        customer_lon: Customer longitudes, shape (n_customers,)
+        demands: Customer demands, shape (n_customers,)
+        transport_rates: Cost per km of serving each customer, shape (n_customers,)
+    Returns:
+        Total cost per particle and the facility index assigned to each customer
+        per particle (-1 when no facility has capacity left)
+    """
+    n_particles = swarm.shape[0]
+    total_cost = np.empty(n_particles)
+    assignments = np.empty((n_particles, demands.shape[0]), dtype=np.int64)
+    for particle in prange(n_particles):
+        total_cost[particle] = _particle_cost(
+            swarm[particle], customer_lat, customer_lon, demands,
+            facility_capacity, fixed_cost, transport_rates,
+            assignments[particle]
+        )
+    return total_cost, assignments
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _pso_step(
+    particles: np.ndarray,
+    velocities: np.ndarray,
+    personal_best_positions: np.ndarray,
+    personal_best_scores: np.ndarray,
+    global_best_position: np.ndarray,
+    random_pulls: np.ndarray,
+    inertia_weight: float,
+    cognitive_coefficient: float,
+    social_coefficient: float,
+    lower_bounds: np.ndarray,
+    upper_bounds: np.ndarray,
+    customer_lat: np.ndarray,
+    customer_lon: np.ndarray,
+    demands: np.ndarray,
+    facility_capacity: float,
+    fixed_cost: float,
+    transport_rates: np.ndarray
+):
+    """
+    Move every particle one iteration in place and update the personal bests
+    random_pulls holds the cognitive and social random factors, shape (2,) + particles.shape
+    """
+    n_particles, n_facilities, n_dims = particles.shape
+    assignments = np.empty((n_particles, demands.shape[0]), dtype=np.int64)
+    for particle in prange(n_particles):
+        moved = False
+        for facility in range(n_facilities):
+            for dim in range(n_dims):
+                position = particles[particle, facility, dim]
+                velocity = (
+                    inertia_weight * velocities[particle, facility, dim] +
+                    cognitive_coefficient * random_pulls[0, particle, facility, dim] *
+                    (personal_best_positions[particle, facility, dim] - position) +
+                    social_coefficient * random_pulls[1, particle, facility, dim] *
+                    (global_best_position[facility, dim] - position)
+                )
+                velocities[particle, facility, dim] = velocity
+
+                # Apply bounds
+                particles[particle, facility, dim] = min(
+                    max(position + velocity, lower_bounds[dim]), upper_bounds[dim]
+                )
+                moved = moved or particles[particle, facility, dim] != position
+
+        # A particle held in place by the bounds keeps a score already compared to its best
+        if not moved:
+            continue
+        score = _particle_cost(
+            particles[particle], customer_lat, customer_lon, demands,
+            facility_capacity, fixed_cost, transport_rates,
+            assignments[particle]
+        )
+        if score < personal_best_scores[particle]:
+            personal_best_positions[particle] = particles[particle]
+            personal_best_scores[particle] = score
 
 def optimize_facility_locations_pso(
     customers_df: pd.DataFrame,
@@ -78,43 +182,52 @@ def optimize_facility_locations_pso(
     max_run_time_seconds: int = 300,  # Added time limit parameter
     inertia_weight: float = 0.9,
     cognitive_coefficient: float = 2.0,
-    social_coefficient: float = 2.0
+    social_coefficient: float = 2.0,
+    seed: Optional[int] = None
 ) -> Dict:
     """
     Optimize facility locations using Particle Swarm Optimization
+    All randomness is drawn from one generator seeded with seed, so seeded runs are reproducible
     """
     import time
     start_time = time.time()
+    rng = np.random.default_rng(seed)
     
     # Extract data from DataFrame
     customers = customers_df['CustomerID'].tolist()
-    demands = dict(zip(customers_df['CustomerID'], customers_df['Demand']))
-    customer_coords = dict(zip(customers_df['CustomerID'], 
-                             zip(customers_df['Latitude'], customers_df['Longitude'])))
+    demands = customers_df['Demand'].tolist()
+    demand_array = customers_df['Demand'].to_numpy(dtype=float)
+    # A customer's loads do not depend on where the facilities are, so the cost per km of
+    # serving each customer is computed once rather than in every fitness evaluation
+    transport_rates = cost_per_km * np.ceil(demand_array / units_per_load)
+    cost_args = (
+        customers_df['Latitude'].to_numpy(dtype=float),
+        customers_df['Longitude'].to_numpy(dtype=float),
+        demand_array,
+        facility_capacity, fixed_cost, transport_rates
+    )
     
     # Define bounds
     lat_bounds = (customers_df['Latitude'].min(), customers_df['Latitude'].max())
     lon_bounds = (customers_df['Longitude'].min(), customers_df['Longitude'].max())
+    lower_bounds = np.array([lat_bounds[0], lon_bounds[0]], dtype=float)
+    upper_bounds = np.array([lat_bounds[1], lon_bounds[1]], dtype=float)
     
     # Initialize particles
-    particles = np.random.uniform(
-        low=[lat_bounds[0], lon_bounds[0]], 
-        high=[lat_bounds[1], lon_bounds[1]], 
+    particles = rng.uniform(
+        low=lower_bounds, 
+        high=upper_bounds, 
         size=(n_particles, n_facilities, 2)
     )
-    velocities = np.random.uniform(-1, 1, size=(n_particles, n_facilities, 2))
+    velocities = rng.uniform(-1, 1, size=(n_particles, n_facilities, 2))
     
     # Initialize best positions and scores
     personal_best_positions = np.copy(particles)
-    personal_best_scores = np.array([
-        calculate_total_cost(
-            p, customers, demands, customer_coords,
-            facility_capacity, fixed_cost, cost_per_km, units_per_load
-        )[0] for p in personal_best_positions
-    ])
+    with _parallel_kernel_lock:
+        personal_best_scores, _ = calculate_swarm_costs(personal_best_positions, *cost_args)
     
     global_best_index = np.argmin(personal_best_scores)
-    global_best_position = personal_best_positions[global_best_index]
+    global_best_position = np.copy(personal_best_positions[global_best_index])
     global_best_score = personal_best_scores[global_best_index]
     
     current_inertia_weight = inertia_weight
@@ -128,34 +241,17 @@ def optimize_facility_locations_pso(
         if time.time() - start_time > max_run_time_seconds:
             break
             
-        for i in range(n_particles):
-            inertia = current_inertia_weight * velocities[i]
-            cognitive_component = cognitive_coefficient * np.random.rand(n_facilities, 2) * (
-                personal_best_positions[i] - particles[i]
-            )
-            social_component = social_coefficient * np.random.rand(n_facilities, 2) * (
-                global_best_position - particles[i]
-            )
-            
-            velocities[i] = inertia + cognitive_component + social_component
-            particles[i] += velocities[i]
-            
-            # Apply bounds
-            particles[i] = np.clip(
-                particles[i], 
-                [lat_bounds[0], lon_bounds[0]], 
-                [lat_bounds[1], lon_bounds[1]]
+        # Move the swarm and update personal bests in one compiled pass, with this
+        # iteration's random factors drawn in a single call
+        random_pulls = rng.random((2,) + particles.shape)
+        with _parallel_kernel_lock:
+            _pso_step(
+                particles, velocities, personal_best_positions, personal_best_scores,
+                global_best_position, random_pulls, current_inertia_weight,
+                cognitive_coefficient, social_coefficient,
+                lower_bounds, upper_bounds, *cost_args
             )
 
-            score, assignments = calculate_total_cost(
-                particles[i], customers, demands, customer_coords,
-                facility_capacity, fixed_cost, cost_per_km, units_per_load
-            )
-            
-            if score < personal_best_scores[i]:
-                personal_best_positions[i] = np.copy(particles[i])
-                personal_best_scores[i] = score
-
         best_particle_index = np.argmin(personal_best_scores)
         if personal_best_scores[best_particle_index] < global_best_score:
             global_best_position = np.copy(personal_best_positions[best_particle_index])
@@ -173,10 +269,9 @@ def optimize_facility_locations_pso(
         completed_iterations = iteration + 1
 
     # Calculate final assignments and costs
-    total_cost, final_assignments = calculate_total_cost(
-        global_best_position, customers, demands, customer_coords,
-        facility_capacity, fixed_cost, cost_per_km, units_per_load
-    )
+    with _parallel_kernel_lock:
+        final_costs, final_assignments = calculate_swarm_costs(global_best_position[np.newaxis], *cost_args)
+    total_cost = float(final_costs[0])
 
     # Prepare results in a structured format
     facility_locations = [
@@ -187,10 +282,10 @@ def optimize_facility_locations_pso(
     assignments_list = [
         {
             'CustomerID': customer,
-            'FacilityID': f'FAC{facility+1}' if facility is not None else None,
-            'Demand': demands[customer]
+            'FacilityID': f'FAC{facility+1}' if facility >= 0 else None,
+            'Demand': demand
         }
-        for customer, facility in final_assignments.items()
+        for customer, facility, demand in zip(customers, final_assignments[0], demands)
     ]
 
     total_time = time.time() - start_time
@@ -203,4 +298,50 @@ def optimize_facility_locations_pso(
         'history': pd.DataFrame(history),
         'completed_iterations': completed_iterations,
         'total_time': total_time
-    }
\ No newline at end of file
+    }
+
+def _run_restart(customers_df: pd.DataFrame, n_threads: int, params: Dict) -> Dict:
+    """Runs one swarm of optimize_facility_locations_pso_restarts in a worker process"""
+    # The workers share the CPUs, so each one's parallel kernels get an equal share of threads
+    set_num_threads(n_threads)
+    return optimize_facility_locations_pso(customers_df, **params)
+
+def optimize_facility_locations_pso_restarts(
+    customers_df: pd.DataFrame,
+    n_restarts: int = 1,
+    seed: Optional[int] = None,
+    max_workers: Optional[int] = None,
+    **params
+) -> Dict:
+    """
+    Run independent PSO swarms in parallel worker processes and return the best result
+    Every swarm gets the full max_run_time_seconds budget, so restarts improve the solution
+    found in the same wall time rather than finishing sooner.
+    Args:
+        customers_df: DataFrame with customer data
+        n_restarts: Number of independent swarms (1 runs a single swarm in this process)
+        seed: Seed from which every swarm's seed is derived
+        max_workers: Number of worker processes (default: one per swarm, up to the CPU count)
+        params: Remaining optimize_facility_locations_pso parameters, shared by all swarms
+    """
+    if n_restarts <= 1:
+        return optimize_facility_locations_pso(customers_df, seed=seed, **params)
+
+    import time
+    start_time = time.time()
+    seeds = [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(n_restarts)]
+    n_cpus = os.cpu_count() or 1
+    max_workers = max_workers or min(n_restarts, n_cpus)
+
+    # Spawned workers avoid forking the threads of the Streamlit server
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [
+            executor.submit(_run_restart, customers_df, max(1, n_cpus // max_workers),
+                            {**params, 'seed': restart_seed})
+            for restart_seed in seeds
+        ]
+        results = [future.result() for future in futures]
+
+    best = min(results, key=lambda result: result['total_cost'])
+    return {**best, 'total_time': time.time() - start_time}
\ No newline at end of file
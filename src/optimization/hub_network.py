@@ -1,12 +1,43 @@
 import pulp
 import pandas as pd
 import numpy as np
-from typing import Dict, Tuple, List
+from typing import Dict, Tuple, List, Optional
+from src.optimization.milp_utils import apply_warm_start, extract_warm_start, solve_with_stagnation
 
 def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """Calculates Euclidean distance and converts to kilometers"""
     return np.sqrt((lat1 - lat2)**2 + (lon1 - lon2)**2) * 111.2
 
+def city_distance_matrices(
+    origins_df: pd.DataFrame,
+    candidate_hubs_df: pd.DataFrame,
+    destinations_df: pd.DataFrame
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Origin x destination, origin x hub and hub x destination calculate_distance matrices
+    Rows and columns follow the row order of the DataFrames. A city listed more than once is
+    placed at its last listed coordinates, and a city paired with itself gets the 9999 km used
+    for unknown pairs.
+    """
+    cities = pd.concat([origins_df, candidate_hubs_df, destinations_df])
+    cities = cities.drop_duplicates('City', keep='last')
+    positions = pd.Index(cities['City'])
+    lat = cities['Latitude'].to_numpy(dtype=float)
+    lon = cities['Longitude'].to_numpy(dtype=float)
+
+    def matrix(rows_df: pd.DataFrame, cols_df: pd.DataFrame) -> np.ndarray:
+        rows = positions.get_indexer(rows_df['City'])
+        cols = positions.get_indexer(cols_df['City'])
+        distances = calculate_distance(lat[rows][:, None], lon[rows][:, None], lat[cols], lon[cols])
+        distances[rows[:, None] == cols] = 9999
+        return distances
+
+    return (
+        matrix(origins_df, destinations_df),
+        matrix(origins_df, candidate_hubs_df),
+        matrix(candidate_hubs_df, destinations_df)
+    )
+
 def optimize_hub_network(
     origins_df: pd.DataFrame,
     candidate_hubs_df: pd.DataFrame,
@@ -17,7 +48,9 @@ def optimize_hub_network(
     capacity_per_shipment: float,
     minimum_cost_per_load: float,
     time_limit: int,
-    optimality_gap: float
+    optimality_gap: float,
+    stagnation_seconds: Optional[float] = None,
+    warm_start: Optional[Dict[str, float]] = None
 ) -> Dict:
     """
     Optimize hub-and-spoke network design
@@ -33,6 +66,8 @@ def optimize_hub_network(
         minimum_cost_per_load: Minimum cost per load (regardless of distance)
         time_limit: Maximum solver runtime in seconds
         optimality_gap: Relative optimality gap for solver
+        stagnation_seconds: Stop once the best solution has not improved for this many seconds
+        warm_start: Variable values from a previous solve to use as a MIP start
     
     Returns:
         Dictionary containing optimization results
@@ -42,16 +77,18 @@ def optimize_hub_network(
     hubs = candidate_hubs_df['City'].tolist()
     destinations = destinations_df['City'].tolist()
     
-    # Create distance dictionary
-    distances = {}
-    for df in [origins_df, candidate_hubs_df, destinations_df]:
-        for _, row in df.iterrows():
-            for df2 in [origins_df, candidate_hubs_df, destinations_df]:
-                for _, row2 in df2.iterrows():
-                    if row['City'] != row2['City']:
-                        dist = calculate_distance(row['Latitude'], row['Longitude'], 
-                                               row2['Latitude'], row2['Longitude'])
-                        distances[(row['City'], row2['City'])] = dist
+    # Distance matrices, indexed by the positions of the cities in the lists above
+    od_distances, oh_distances, hd_distances = city_distance_matrices(
+        origins_df, candidate_hubs_df, destinations_df
+    )
+    # Candidate hub data in the order of hubs, taken from the first row listing each city
+    hub_data = candidate_hubs_df.drop_duplicates('City').set_index('City').loc[hubs]
+    hub_fixed_costs = hub_data['FixedCost'].to_numpy()
+
+    # Cost per load on each arc, never below the minimum cost per load
+    od_costs = np.maximum(minimum_cost_per_load, od_distances * cost_per_unit_distance)
+    oh_costs = np.maximum(minimum_cost_per_load, oh_distances * cost_per_unit_distance)
+    hd_costs = np.maximum(minimum_cost_per_load, hd_distances * cost_per_unit_distance)
 
     # Create demand dictionary
     demand = {(row['Origin'], row['Destination']): row['Demand'] 
@@ -66,13 +103,18 @@ def optimize_hub_network(
                              ((i, j) for i in origins for j in destinations), 
                              lowBound=0, cat='Continuous')
     
-    # Hub flow variables
+    # Hub flow variables, only for lanes with demand since the others carry no flow
     y = pulp.LpVariable.dicts("HubFlow", 
-                             ((i, h, j) for i in origins for h in hubs for j in destinations), 
+                             ((i, h, j) for i in origins for h in hubs for j in destinations
+                              if demand.get((i, j), 0) > 0), 
                              lowBound=0, cat='Continuous')
     
-    # Hub opening variables
-    z = pulp.LpVariable.dicts("HubOpen", hubs, cat='Binary')
+    # Hub opening variables. When every candidate hub may be opened at no cost, opening all
+    # of them is optimal, so they are fixed open rather than branched on
+    if max_hubs >= len(hubs) and not hub_fixed_costs.any():
+        z = pulp.LpVariable.dicts("HubOpen", hubs, lowBound=1, upBound=1, cat='Continuous')
+    else:
+        z = pulp.LpVariable.dicts("HubOpen", hubs, cat='Binary')
     
     # Load variables (integer)
     l_direct = pulp.LpVariable.dicts("DirectLoads", 
@@ -87,85 +129,113 @@ def optimize_hub_network(
                                 ((h, j) for h in hubs for j in destinations), 
                                 lowBound=0, cat='Integer')
 
-    # Objective function
+    # No arc needs more loads than it takes to carry all the demand that can use it, so the
+    # load variables are bounded by the lane, origin and destination totals
+    lane_demand = np.array([[demand.get((i, j), 0) for j in destinations] for i in origins], dtype=float)
+    lane_loads = np.ceil(lane_demand / capacity_per_shipment)
+    origin_loads = np.ceil(lane_demand.sum(axis=1) / capacity_per_shipment)
+    destination_loads = np.ceil(lane_demand.sum(axis=0) / capacity_per_shipment)
+    for oi, i in enumerate(origins):
+        for di, j in enumerate(destinations):
+            l_direct[i, j].upBound = lane_loads[oi, di]
+        for h in hubs:
+            l_oh[i, h].upBound = origin_loads[oi]
+    for h in hubs:
+        for di, j in enumerate(destinations):
+            l_hd[h, j].upBound = destination_loads[di]
+
+    # Objective function, with each term built in one pass from the flattened cost matrices
     model += (
         # Direct shipping costs
-        pulp.lpSum(l_direct[i, j] * max(minimum_cost_per_load, 
-                                       distances.get((i, j), 9999) * cost_per_unit_distance)
-                   for i in origins for j in destinations) +
+        pulp.LpAffineExpression(zip([l_direct[i, j] for i in origins for j in destinations],
+                                    od_costs.ravel().tolist())) +
         # Origin to hub shipping costs
-        pulp.lpSum(l_oh[i, h] * max(minimum_cost_per_load, 
-                                   distances.get((i, h), 9999) * cost_per_unit_distance)
-                   for i in origins for h in hubs) +
+        pulp.LpAffineExpression(zip([l_oh[i, h] for i in origins for h in hubs],
+                                    oh_costs.ravel().tolist())) +
         # Hub to destination shipping costs
-        pulp.lpSum(l_hd[h, j] * max(minimum_cost_per_load, 
-                                   distances.get((h, j), 9999) * cost_per_unit_distance)
-                   for h in hubs for j in destinations) +
+        pulp.LpAffineExpression(zip([l_hd[h, j] for h in hubs for j in destinations],
+                                    hd_costs.ravel().tolist())) +
         # Fixed costs for opening hubs
-        pulp.lpSum(candidate_hubs_df.loc[candidate_hubs_df['City'] == h, 'FixedCost'].values[0] * z[h] 
-                   for h in hubs)
+        pulp.LpAffineExpression(zip([z[h] for h in hubs], hub_fixed_costs.tolist()))
     )
 
+    # Hub flow variables grouped by lane, origin to hub arc and hub to destination arc
+    lane_flows, oh_flows, hd_flows = {}, {}, {}
+    for (i, h, j), flow in y.items():
+        lane_flows.setdefault((i, j), []).append((flow, 1))
+        oh_flows.setdefault((i, h), []).append((flow, 1))
+        hd_flows.setdefault((h, j), []).append((flow, 1))
+
     # Constraints
-    # Demand satisfaction constraints
+    # Demand satisfaction constraints. Constraints are built directly from (variable,
+    # coefficient) pairs, as the comparison operators copy their expressions several times
     for i in origins:
         for j in destinations:
-            model += (x[i, j] + pulp.lpSum(y[i, h, j] for h in hubs) == demand.get((i, j), 0), 
-                     f"Demand_{i}_{j}")
+            model += pulp.LpConstraint([(x[i, j], 1)] + lane_flows.get((i, j), []), 
+                                      pulp.LpConstraintEQ, f"Demand_{i}_{j}", demand.get((i, j), 0))
 
     # Direct shipping capacity constraints
     for i in origins:
         for j in destinations:
-            model += (x[i, j] <= l_direct[i, j] * capacity_per_shipment, 
-                     f"DirectCapacity_{i}_{j}")
+            model += pulp.LpConstraint([(x[i, j], 1), (l_direct[i, j], -capacity_per_shipment)], 
+                                      pulp.LpConstraintLE, f"DirectCapacity_{i}_{j}", 0)
 
     # Origin-hub capacity constraints
     for i in origins:
         for h in hubs:
-            model += (pulp.lpSum(y[i, h, j] for j in destinations) <= 
-                     l_oh[i, h] * capacity_per_shipment, 
-                     f"OriginHubCapacity_{i}_{h}")
+            model += pulp.LpConstraint(oh_flows.get((i, h), []) + [(l_oh[i, h], -capacity_per_shipment)], 
+                                      pulp.LpConstraintLE, f"OriginHubCapacity_{i}_{h}", 0)
 
     # Hub-destination capacity constraints
     for h in hubs:
         for j in destinations:
-            model += (pulp.lpSum(y[i, h, j] for i in origins) <= 
-                     l_hd[h, j] * capacity_per_shipment, 
-                     f"HubDestinationCapacity_{h}_{j}")
+            model += pulp.LpConstraint(hd_flows.get((h, j), []) + [(l_hd[h, j], -capacity_per_shipment)], 
+                                      pulp.LpConstraintLE, f"HubDestinationCapacity_{h}_{j}", 0)
 
-    # Hub opening constraints
-    for h in hubs:
-        model += (pulp.lpSum(y[i, h, j] for i in origins for j in destinations) <= 
-                 z[h] * sum(demand.values()), 
-                 f"HubOpening_{h}")
+    # Hub opening constraints, one per lane so each flow is bounded by its own demand
+    # rather than the total demand, which tightens the LP relaxation
+    for i, h, j in y:
+        model += pulp.LpConstraint([(y[i, h, j], 1), (z[h], -demand[i, j])], 
+                                  pulp.LpConstraintLE, f"HubOpening_{i}_{h}_{j}", 0)
 
     # Maximum number of hubs constraint
-    model += (pulp.lpSum(z[h] for h in hubs) <= max_hubs, 
+    model += (pulp.LpAffineExpression((z[h], 1) for h in hubs) <= max_hubs, 
              "MaxHubs")
 
-    # Solve the model
-    solver = pulp.PULP_CBC_CMD(timeLimit=time_limit, gapRel=optimality_gap)
-    model.solve(solver)
+    # Symmetry breaking: hubs with the same fixed cost and the same cost on every arc are
+    # interchangeable, so they are opened in list order
+    interchangeable = {}
+    for hi, h in enumerate(hubs):
+        key = (hub_fixed_costs[hi], oh_costs[:, hi].tobytes(), hd_costs[hi].tobytes())
+        if key in interchangeable:
+            model += (z[interchangeable[key]] >= z[h], f"HubSymmetry_{h}")
+        interchangeable[key] = h
+
+    # Solve the model, seeded with the previous incumbent when one is available
+    use_warm_start = apply_warm_start(model, warm_start)
+    solver_time = solve_with_stagnation(model, time_limit=time_limit, gap_rel=optimality_gap,
+                                        stagnation_seconds=stagnation_seconds,
+                                        warm_start=use_warm_start)
 
     # Process results
     facilities_df = pd.DataFrame({
         'City': hubs,
         'IsOpen': [pulp.value(z[h]) == 1 for h in hubs],
-        'Latitude': [candidate_hubs_df.loc[candidate_hubs_df['City'] == h, 'Latitude'].values[0] for h in hubs],
-        'Longitude': [candidate_hubs_df.loc[candidate_hubs_df['City'] == h, 'Longitude'].values[0] for h in hubs]
+        'Latitude': hub_data['Latitude'].to_numpy(),
+        'Longitude': hub_data['Longitude'].to_numpy()
     })
 
     # Collect flow information
     connections = []
     
     # Direct flows
-    for i in origins:
-        for j in destinations:
+    for oi, i in enumerate(origins):
+        for di, j in enumerate(destinations):
             direct_flow = pulp.value(x[i, j])
             if direct_flow > 0:
                 loads = pulp.value(l_direct[i, j])
-                distance = distances.get((i, j), 9999)
-                cost = loads * max(minimum_cost_per_load, distance * cost_per_unit_distance)
+                distance = od_distances[oi, di]
+                cost = loads * od_costs[oi, di]
                 connections.append({
                     'From': i,
                     'To': j,
@@ -177,17 +247,19 @@ def optimize_hub_network(
                 })
 
     # Hub flows
-    for i in origins:
-        for h in hubs:
-            for j in destinations:
+    for oi, i in enumerate(origins):
+        for hi, h in enumerate(hubs):
+            for di, j in enumerate(destinations):
+                if (i, h, j) not in y:
+                    continue
                 hub_flow = pulp.value(y[i, h, j])
                 if hub_flow > 0:
                     oh_loads = pulp.value(l_oh[i, h])
                     hd_loads = pulp.value(l_hd[h, j])
-                    distance_oh = distances.get((i, h), 9999)
-                    distance_hd = distances.get((h, j), 9999)
-                    cost_oh = oh_loads * max(minimum_cost_per_load, distance_oh * cost_per_unit_distance)
-                    cost_hd = hd_loads * max(minimum_cost_per_load, distance_hd * cost_per_unit_distance)
+                    distance_oh = oh_distances[oi, hi]
+                    distance_hd = hd_distances[hi, di]
+                    cost_oh = oh_loads * oh_costs[oi, hi]
+                    cost_hd = hd_loads * hd_costs[hi, di]
                     connections.append({
                         'From': i,
                         'To': j,
@@ -207,5 +279,6 @@ def optimize_hub_network(
         'total_cost': pulp.value(model.objective),
         'connections': pd.DataFrame(connections),
         'facilities': facilities_df,
-        'solver_time': solver.solution_time if hasattr(solver, 'solution_time') else None
+        'solver_time': solver_time,
+        'warm_start': extract_warm_start(model)
     }
\ No newline at end of file
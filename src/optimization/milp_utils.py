@@ -0,0 +1,120 @@
+import os
+import time
+import pulp
+from typing import Dict, Optional
+
+# HiGHS usually solves these models faster than CBC, so it is used when its binary is installed
+HIGHS_AVAILABLE = pulp.HiGHS_CMD(msg=False).available()
+
+def apply_warm_start(prob: pulp.LpProblem, warm_start: Optional[Dict[str, float]]) -> bool:
+    """
+    Set initial values on the problem variables from a previous solution
+    Args:
+        prob: PuLP problem to warm start
+        warm_start: Mapping of variable name to value, as returned by extract_warm_start
+    Returns:
+        True if any variable received an initial value
+    """
+    if not warm_start:
+        return False
+
+    applied = False
+    for var in prob.variables():
+        value = warm_start.get(var.name)
+        if value is not None:
+            # Values rounded just outside a bound are skipped rather than raising
+            applied = var.setInitialValue(value, check=False) or applied
+    return applied
+
+def extract_warm_start(prob: pulp.LpProblem) -> Dict[str, float]:
+    """Collect the solved variable values so they can seed the next solve"""
+    return {var.name: var.varValue for var in prob.variables() if var.varValue is not None}
+
+def mip_solver(
+    time_limit: float,
+    gap_rel: float,
+    warm_start: bool = False,
+    msg: bool = False,
+    **cbc_options
+) -> pulp.LpSolver:
+    """
+    HiGHS if it is installed, otherwise CBC, configured with the same limits
+    Args:
+        time_limit: Solver time limit in seconds
+        gap_rel: Relative MIP gap tolerance
+        warm_start: Whether the problem variables hold a MIP start
+        msg: Whether to show solver output
+        cbc_options: Additional PULP_CBC_CMD arguments, ignored by HiGHS
+    """
+    if HIGHS_AVAILABLE:
+        return pulp.HiGHS_CMD(
+            timeLimit=time_limit,
+            gapRel=gap_rel,
+            warmStart=warm_start,
+            threads=os.cpu_count(),
+            msg=msg
+        )
+    return pulp.PULP_CBC_CMD(
+        timeLimit=time_limit,
+        gapRel=gap_rel,
+        warmStart=warm_start,
+        msg=msg,
+        **cbc_options
+    )
+
+def solve_with_stagnation(
+    prob: pulp.LpProblem,
+    time_limit: float,
+    gap_rel: float,
+    stagnation_seconds: Optional[float] = None,
+    improvement_tolerance: float = 1e-4,
+    warm_start: bool = False,
+    **solver_options
+) -> float:
+    """
+    Solve with mip_solver, stopping early once the incumbent stops improving
+    Neither solver exposes an incumbent callback through PuLP, so the time budget is spent in
+    slices of stagnation_seconds. Each slice is warm started from the previous incumbent and
+    the search stops when a slice proves the gap or improves the objective by no more than
+    improvement_tolerance (relative).
+    Args:
+        prob: PuLP problem to solve
+        time_limit: Total solver time budget in seconds
+        gap_rel: Relative MIP gap tolerance
+        stagnation_seconds: Seconds without improvement before stopping (None disables)
+        improvement_tolerance: Relative objective improvement that counts as progress
+        warm_start: Whether the problem variables already hold a MIP start
+        solver_options: Additional mip_solver arguments
+    Returns:
+        Total solver wall time in seconds
+    """
+    start_time = time.monotonic()
+    best_objective = None
+
+    while True:
+        remaining = time_limit - (time.monotonic() - start_time)
+        if remaining <= 0:
+            break
+
+        slice_limit = min(stagnation_seconds, remaining) if stagnation_seconds else remaining
+        prob.solve(mip_solver(slice_limit, gap_rel, warm_start=warm_start, **solver_options))
+
+        if not stagnation_seconds:
+            break
+        if prob.sol_status == pulp.LpSolutionNoSolutionFound and best_objective is None:
+            # Nothing to measure stagnation against yet, spend the rest of the budget in one solve
+            stagnation_seconds = None
+            continue
+        if prob.sol_status != pulp.LpSolutionIntegerFeasible:
+            # Gap proven, or the problem is infeasible/unbounded
+            break
+
+        objective = pulp.value(prob.objective)
+        if (best_objective is not None and
+                objective > best_objective - improvement_tolerance * abs(best_objective)):
+            break
+        best_objective = objective
+        # The variables now hold the incumbent, which seeds the next slice
+        warm_start = True
+
+    return time.monotonic() - start_time
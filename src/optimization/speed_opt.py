@@ -0,0 +1,127 @@
+import pandas as pd
+import numpy as np
+from typing import Dict, Tuple
+
+def optimize_speeds(
+    arc_distances: np.ndarray,
+    window_start: np.ndarray,
+    window_end: np.ndarray,
+    service_times: np.ndarray,
+    min_speed: float = 30.0,
+    max_speed: float = 60.0,
+    start_time: float = 0.0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Choose the speed on each arc of a fixed route so every stop is reached before its window closes
+    Fuel cost grows with speed, so each stretch of the route is driven at the lowest speed that
+    meets its tightest deadline: from the current stop s the required speed is
+    max over later stops j of (D(j) - D(s)) / (l_j - t_s - S(s, j)), where D is the cumulative
+    distance and S the service time at the stops in between. The stretch up to the binding stop
+    is driven at that speed and the search restarts from there, or from the first stop in it that
+    would be reached before its window opens, since the wait there shifts every later deadline.
+    O(|R|^2) per route.
+    Args:
+        arc_distances: Distance (km) of each arc along the route
+        window_start: Earliest service start (minutes) at each stop, 0 if unconstrained
+        window_end: Latest service start (minutes) at each stop, inf if unconstrained
+        service_times: Service time (minutes) at each stop
+        min_speed: Economical cruising speed (km/h), used wherever no deadline binds
+        max_speed: Maximum speed (km/h); deadlines that need more are missed
+        start_time: Departure time (minutes) from the first stop
+    Returns:
+        Tuple of (speeds, arrival_times): speed (km/h) on each arc and arrival time (minutes) at each stop
+    """
+    num_stops = len(arc_distances) + 1
+    cumulative_distance = np.concatenate(([0.0], np.cumsum(arc_distances)))
+    cumulative_service = np.concatenate(([0.0], np.cumsum(service_times)))
+
+    speeds = np.empty(num_stops - 1)
+    arrival_times = np.empty(num_stops)
+    arrival_times[0] = departure = start_time
+
+    stop = 0
+    while stop < num_stops - 1:
+        later = np.arange(stop + 1, num_stops)
+        # Time left to reach each later stop, after serving the stops in between
+        available = (window_end[later] - departure -
+                     (cumulative_service[later] - cumulative_service[stop + 1]))
+        distance = cumulative_distance[later] - cumulative_distance[stop]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            required = np.where(available > 0, distance / available * 60, np.inf)
+
+        binding = int(np.argmax(required))
+        speed = float(np.clip(required[binding], min_speed, max_speed))
+        # Without a binding deadline the next stop is planned on its own
+        end = later[binding] if required[binding] > min_speed else stop + 1
+        
+        # The deadlines above assume no waiting, so re-plan from the first stop
+        # reached before its window opens, arriving there no earlier than needed
+        segment = slice(0, end - stop)
+        arrivals = (departure + distance[segment] / speed * 60 +
+                    cumulative_service[later[segment]] - cumulative_service[stop + 1])
+        waits = np.flatnonzero(arrivals < window_start[later[segment]])
+        if waits.size:
+            first = waits[0]
+            slack = (window_start[later[first]] - departure -
+                     (cumulative_service[later[first]] - cumulative_service[stop + 1]))
+            slower = max(distance[first] / slack * 60, required[:first].max(initial=0.0))
+            speed = float(np.clip(slower, min_speed, speed))
+            end = later[first]
+
+        for arc in range(stop, end):
+            speeds[arc] = speed
+            arrival_times[arc + 1] = departure + arc_distances[arc] / speed * 60
+            departure = max(arrival_times[arc + 1], window_start[arc + 1]) + service_times[arc + 1]
+        stop = end
+
+    return speeds, arrival_times
+
+def add_optimized_speeds(
+    results: Dict,
+    df: pd.DataFrame,
+    distance_matrix: np.ndarray,
+    min_speed: float = 30.0,
+    max_speed: float = 60.0
+) -> Dict:
+    """
+    Add optimize_speeds output to each route of a solve_vrp result
+    route_info gains 'speeds' (list of km/h per arc for each route) and 'optimized_time' (array of
+    minutes from leaving to returning to the depot).
+    Args:
+        results: Successful solve_vrp result
+        df: Locations the routes index into, depot first
+        distance_matrix: Distance matrix in meters from compute_vrp_matrices
+        min_speed: Economical cruising speed (km/h)
+        max_speed: Maximum speed (km/h)
+    """
+    window_start = df['Time_Window_Start'].to_numpy(dtype=float)
+    window_end = df['Time_Window_End'].to_numpy(dtype=float)
+    # Windows are only enforced when every location has one, as in solve_vrp
+    if np.isnan(window_start).any() or np.isnan(window_end).any():
+        window_start = np.zeros(len(df))
+        window_end = np.full(len(df), np.inf)
+    if 'Service_Time' in df.columns:
+        service_times = df['Service_Time'].fillna(0).to_numpy(dtype=float)
+    else:
+        service_times = np.zeros(len(df))
+
+    route_info = results['route_info']
+    route_info['speeds'] = []
+    route_info['optimized_time'] = np.empty(len(route_info['locations']))
+    for i, route in enumerate(route_info['locations']):
+        route = np.asarray(route)
+        # The return to the depot is not bound by the depot's window
+        route_window_end = window_end[route]
+        route_window_end[-1] = np.inf
+        speeds, arrival_times = optimize_speeds(
+            distance_matrix[route[:-1], route[1:]] / 1000,
+            window_start[route],
+            route_window_end,
+            service_times[route],
+            min_speed,
+            max_speed
+        )
+        route_info['speeds'].append(speeds.tolist())
+        route_info['optimized_time'][i] = arrival_times[-1] - arrival_times[0]
+
+    return results
\ No newline at end of file
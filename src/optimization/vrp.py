@@ -1,17 +1,112 @@
 import pandas as pd
 import numpy as np
+from numba import njit, prange
 from ortools.constraint_solver import routing_enums_pb2
 from ortools.constraint_solver import pywrapcp
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _fill_vrp_matrices(
+    latitudes: np.ndarray,
+    longitudes: np.ndarray,
+    distance_matrix: np.ndarray,
+    time_matrix: np.ndarray
+) -> None:
+    """Fill both matrices row by row from coordinates in radians, without N x N temporaries"""
+    n = latitudes.shape[0]
+    for i in prange(n):
+        cos_lat = np.cos(latitudes[i])
+        for j in range(n):
+            a = (np.sin((latitudes[j] - latitudes[i])/2)**2 +
+                 cos_lat * np.cos(latitudes[j]) * np.sin((longitudes[j] - longitudes[i])/2)**2)
+            distance_km = 6371 * 2 * np.arcsin(np.sqrt(a))
+            distance_matrix[i, j] = np.rint(distance_km * 1000)
+            time_matrix[i, j] = distance_km * 2
+
+def compute_vrp_matrices(
+    latitudes: np.ndarray,
+    longitudes: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculate the distance and travel time matrices between all locations
+    OR-Tools only accepts integer costs, so both are returned as int32: distances in
+    meters and travel times in whole minutes.
+    Args:
+        latitudes: Latitude of each location, depot first
+        longitudes: Longitude of each location, depot first
+    Returns:
+        Tuple of (distance_matrix, time_matrix)
+    """
+    # Haversine distance between every pair of locations, computed in parallel over rows
+    latitudes = np.radians(np.asarray(latitudes, dtype=float))
+    longitudes = np.radians(np.asarray(longitudes, dtype=float))
+    num_locations = len(latitudes)
+    
+    distance_matrix = np.empty((num_locations, num_locations), dtype=np.int32)  # Distance in meters
+    # Time assumes an average speed of 30 km/h
+    time_matrix = np.empty((num_locations, num_locations), dtype=np.int32)  # Time in minutes
+    _fill_vrp_matrices(latitudes, longitudes, distance_matrix, time_matrix)
+    
+    return distance_matrix, time_matrix
+
+def check_time_window_feasibility(
+    df: pd.DataFrame,
+    time_matrix: np.ndarray,
+    num_vehicles: int,
+    horizon: int = 1440
+) -> Tuple[List[int], List[Tuple[int, int]]]:
+    """
+    Screen the time windows for conflicts that make the VRP infeasible, before solving
+    Vehicles are assumed to leave the depot at time 0 at the earliest and wait for free. Only
+    direct legs are checked, in O(N^2): travel times are truncated to whole minutes, so a leg
+    is only reported when it misses a window by more than one minute per leg, the most a
+    detour through one other stop can gain on it through truncation.
+    Args:
+        df: Locations with Time_Window_Start and Time_Window_End, depot first
+        time_matrix: Travel times in minutes from compute_vrp_matrices
+        num_vehicles: Number of vehicles available
+        horizon: Maximum route duration in minutes, as used by solve_vrp
+    Returns:
+        Tuple of (unreachable, conflicts): positions of locations that cannot be served
+        within their window by any vehicle, and pairs of positions that cannot share a
+        route (only checked for a single vehicle)
+    """
+    window_start = df['Time_Window_Start'].to_numpy(dtype=float)
+    window_end = df['Time_Window_End'].to_numpy(dtype=float)
+    # Travel times less the truncation allowance of one minute per leg
+    time_matrix = np.asarray(time_matrix, dtype=float) - 1
+    
+    # Earliest time each location can be served, leaving the depot at time 0
+    earliest = np.maximum(window_start, time_matrix[0])
+    unreachable = (
+        (window_start > window_end) |
+        (time_matrix[0] > window_end) |
+        (earliest + time_matrix[:, 0] > horizon)
+    )
+    unreachable[0] = False
+    
+    conflicts = []
+    if num_vehicles == 1:
+        # Location j can follow i if j is reached before its window closes
+        can_follow = earliest[:, None] + time_matrix <= window_end[None, :]
+        conflict = ~can_follow & ~can_follow.T
+        conflict[0, :] = conflict[:, 0] = False
+        conflict[unreachable, :] = conflict[:, unreachable] = False
+        conflicts = list(zip(*np.nonzero(np.triu(conflict, k=1))))
+    
+    return np.flatnonzero(unreachable).tolist(), [(int(i), int(j)) for i, j in conflicts]
 
 def create_data_model(
     df: pd.DataFrame,
     num_vehicles: int,
     use_capacity: bool = True,
-    vehicle_capacity: int = 100
+    vehicle_capacity: int = 100,
+    distance_matrix: Optional[np.ndarray] = None,
+    time_matrix: Optional[np.ndarray] = None
 ) -> Dict:
     """
     Prepare data for the VRP solver
+    Matrices from compute_vrp_matrices can be passed in to skip recomputing them.
     """
     data = {}
     data['locations'] = list(zip(df['Latitude'], df['Longitude']))
@@ -31,32 +126,13 @@ def create_data_model(
         data['time_windows'] = list(zip(df['Time_Window_Start'], df['Time_Window_End']))
         data['service_times'] = df['Service_Time'].fillna(0).tolist()
     
-    # Calculate time matrix (using Haversine distance)
-    locations = data['locations']
-    num_locations = len(locations)
-    time_matrix = np.zeros((num_locations, num_locations))
-    
-    for from_node in range(num_locations):
-        for to_node in range(num_locations):
-            if from_node == to_node:
-                time_matrix[from_node][to_node] = 0
-            else:
-                # Haversine formula
-                lat1, lon1 = np.radians([locations[from_node][0], locations[from_node][1]])
-                lat2, lon2 = np.radians([locations[to_node][0], locations[to_node][1]])
-                
-                dlat = lat2 - lat1
-                dlon = lon2 - lon1
-                
-                a = np.sin(dlat/2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2)**2
-                c = 2 * np.arcsin(np.sqrt(a))
-                distance = 6371 * c  # Earth's radius in km
-                
-                # Convert distance to time (assuming average speed of 30 km/h)
-                time_matrix[from_node][to_node] = distance * 2  # Time in minutes
+    # Travel matrices, unless precomputed by the caller
+    if distance_matrix is None or time_matrix is None:
+        distance_matrix, time_matrix = compute_vrp_matrices(df['Latitude'], df['Longitude'])
     
-    data['time_matrix'] = time_matrix.astype(int).tolist()
-    data['distance_matrix'] = time_matrix.tolist()
+    # Kept as arrays; only the matrix registered with OR-Tools is converted to lists
+    data['time_matrix'] = np.asarray(time_matrix)
+    data['distance_matrix'] = np.asarray(distance_matrix)
     
     return data
 
@@ -65,13 +141,25 @@ def solve_vrp(
     num_vehicles: int,
     use_capacity: bool = True,
     vehicle_capacity: int = 100,
-    max_run_time_seconds: int = 30
+    max_run_time_seconds: int = 30,
+    distance_matrix: Optional[np.ndarray] = None,
+    time_matrix: Optional[np.ndarray] = None,
+    max_callback_cache_size: Optional[int] = None,
+    first_solution_strategy: str = 'PARALLEL_CHEAPEST_INSERTION',
+    local_search_metaheuristic: str = 'GUIDED_LOCAL_SEARCH'
 ) -> Dict:
     """
     Solve the Vehicle Routing Problem
+    Matrices from compute_vrp_matrices can be passed in to skip recomputing them.
+    max_callback_cache_size defaults to every arc (N*N) for up to 1000 locations.
+    first_solution_strategy and local_search_metaheuristic are names of the OR-Tools
+    FirstSolutionStrategy and LocalSearchMetaheuristic values.
     """
     # Create data model
-    data = create_data_model(df, num_vehicles, use_capacity, vehicle_capacity)
+    data = create_data_model(
+        df, num_vehicles, use_capacity, vehicle_capacity,
+        distance_matrix=distance_matrix, time_matrix=time_matrix
+    )
     
     # Create routing index manager
     manager = pywrapcp.RoutingIndexManager(
@@ -80,25 +168,22 @@ def solve_vrp(
         data['depot']
     )
     
-    # Create Routing Model
-    routing = pywrapcp.RoutingModel(manager)
+    # Create Routing Model, caching evaluated transit values for every arc
+    num_locations = len(data['time_matrix'])
+    if max_callback_cache_size is None:
+        max_callback_cache_size = num_locations ** 2 if num_locations <= 1000 else 0
+    model_parameters = pywrapcp.DefaultRoutingModelParameters()
+    model_parameters.max_callback_cache_size = max_callback_cache_size
+    model_parameters.reduce_vehicle_cost_model = True
+    routing = pywrapcp.RoutingModel(manager, model_parameters)
 
-    # Create and register transit callback
-    def time_callback(from_index, to_index):
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return data['time_matrix'][from_node][to_node]
-    
-    transit_callback_index = routing.RegisterTransitCallback(time_callback)
+    # Register the travel times as a matrix so arc costs are evaluated in C++
+    transit_callback_index = routing.RegisterTransitMatrix(data['time_matrix'].tolist())
     routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
 
     # Add Capacity constraint if enabled
     if data['use_capacity']:
-        def demand_callback(from_index):
-            from_node = manager.IndexToNode(from_index)
-            return data['demands'][from_node]
-
-        demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
+        demand_callback_index = routing.RegisterUnaryTransitVector(data['demands'])
         routing.AddDimensionWithVehicleCapacity(
             demand_callback_index,
             0,  # null capacity slack
@@ -126,10 +211,13 @@ def solve_vrp(
             index = manager.NodeToIndex(location_idx)
             time_dimension.CumulVar(index).SetRange(time_window[0], time_window[1])
 
-    # Setting first solution heuristic
+    # Setting first solution heuristic and local search metaheuristic
     search_parameters = pywrapcp.DefaultRoutingSearchParameters()
     search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+        getattr(routing_enums_pb2.FirstSolutionStrategy, first_solution_strategy)
+    )
+    search_parameters.local_search_metaheuristic = (
+        getattr(routing_enums_pb2.LocalSearchMetaheuristic, local_search_metaheuristic)
     )
     search_parameters.time_limit.seconds = max_run_time_seconds
 
@@ -139,54 +227,132 @@ def solve_vrp(
     # Extract solution
     if solution:
         routes = []
-        route_info = []
-        total_distance = 0
-        total_time = 0
+        route_distances = []
+        route_times = []
+        route_loads = []
+        
+        demands = np.asarray(data['demands'])
+        service_times = np.asarray(data['service_times'])
         
         for vehicle_id in range(data['num_vehicles']):
             index = routing.Start(vehicle_id)
             route = []
-            route_distance = 0
-            route_time = 0
-            route_load = 0
             
             while not routing.IsEnd(index):
-                node_index = manager.IndexToNode(index)
-                route.append(node_index)
-                route_load += data['demands'][node_index]
-                
-                previous_index = index
+                route.append(manager.IndexToNode(index))
                 index = solution.Value(routing.NextVar(index))
-                
-                # Add distance and time
-                route_distance += data['distance_matrix'][manager.IndexToNode(previous_index)][manager.IndexToNode(index)]
-                route_time += data['time_matrix'][manager.IndexToNode(previous_index)][manager.IndexToNode(index)]
-                
-                if data['use_time_windows']:
-                    route_time += data['service_times'][node_index]
             
             route.append(manager.IndexToNode(index))
             
             if len(route) > 2:  # Only include routes that visit at least one customer
+                # Distance, time and load are summed over the arcs and stops of the route at once
+                stops = np.asarray(route)
+                route_time = data['time_matrix'][stops[:-1], stops[1:]].sum()
+                if data['use_time_windows']:
+                    route_time += service_times[stops[:-1]].sum()
+                
                 routes.append(route)
-                route_info.append({
-                    'distance': route_distance,
-                    'total_time': route_time,
-                    'load': route_load,
-                    'locations': route
-                })
-                total_distance += route_distance
-                total_time += route_time
+                route_distances.append(data['distance_matrix'][stops[:-1], stops[1:]].sum() / 1000)  # Meters to km
+                route_times.append(route_time)
+                route_loads.append(demands[stops[:-1]].sum())
 
+        # Route details are kept as one array per field, indexed by route
+        route_info = {
+            'distance': np.array(route_distances, dtype=float),
+            'total_time': np.array(route_times, dtype=float),
+            'load': np.array(route_loads, dtype=float),
+            'locations': routes
+        }
         return {
             'status': 'SUCCESS',
+            'objective': solution.ObjectiveValue(),
             'routes': routes,
             'route_info': route_info,
-            'total_distance': total_distance,
-            'total_time': total_time
+            'total_distance': float(route_info['distance'].sum()),
+            'total_time': float(route_info['total_time'].sum())
         }
     
     return {
         'status': 'FAILED',
         'error': 'No solution found'
+    }
+
+def cluster_locations(
+    df: pd.DataFrame,
+    num_clusters: int,
+    max_iterations: int = 100,
+    seed: int = 0
+) -> List[np.ndarray]:
+    """
+    Partition the delivery locations into geographic clusters with k-means
+    Each cluster can then be solved as a smaller VRP, trading optimality for solve time.
+    Args:
+        df: Locations with Latitude and Longitude, depot first
+        num_clusters: Number of clusters to form
+        max_iterations: Maximum number of k-means iterations
+        seed: Seed for the k-means++ initialization
+    Returns:
+        List of position arrays into df, one per non-empty cluster, each starting with the depot
+    """
+    coords = df[['Latitude', 'Longitude']].to_numpy(dtype=float)[1:]
+    if len(coords) == 0:
+        # Nothing to deliver: a single cluster holding only the depot
+        return [np.array([0])]
+    rng = np.random.default_rng(seed)
+    
+    # k-means++ initialization
+    centers = coords[[rng.integers(len(coords))]]
+    while len(centers) < min(num_clusters, len(coords)):
+        sq_dist = ((coords[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+        if sq_dist.sum() == 0:
+            break
+        centers = np.vstack([centers, coords[rng.choice(len(coords), p=sq_dist / sq_dist.sum())]])
+    
+    for _ in range(max_iterations):
+        labels = ((coords[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+        new_centers = np.array([
+            coords[labels == c].mean(axis=0) if (labels == c).any() else centers[c]
+            for c in range(len(centers))
+        ])
+        if np.allclose(new_centers, centers):
+            break
+        centers = new_centers
+    
+    return [
+        np.concatenate(([0], 1 + np.flatnonzero(labels == c)))
+        for c in range(len(centers)) if (labels == c).any()
+    ]
+
+def merge_vrp_results(results: List[Dict], clusters: List[np.ndarray]) -> Dict:
+    """
+    Combine solve_vrp results of each cluster, mapping their stops back to positions in the full data
+    If any cluster has no solution, the result is FAILED and 'failed_clusters' lists the indices
+    of those clusters in clusters.
+    """
+    failed = [c for c, result in enumerate(results) if result['status'] != 'SUCCESS']
+    if failed:
+        return {
+            'status': 'FAILED',
+            'error': f'No solution found for clusters {", ".join(map(str, failed))} '
+                     f'of {len(results)}',
+            'failed_clusters': failed
+        }
+    
+    routes = [
+        positions[route].tolist()
+        for result, positions in zip(results, clusters)
+        for route in result['routes']
+    ]
+    route_info = {
+        field: np.concatenate([result['route_info'][field] for result in results])
+        for field in ('distance', 'total_time', 'load')
+    }
+    route_info['locations'] = routes
+    
+    return {
+        'status': 'SUCCESS',
+        'routes': routes,
+        'route_info': route_info,
+        'total_distance': sum(result['total_distance'] for result in results),
+        'total_time': sum(result['total_time'] for result in results)
     }
\ No newline at end of file
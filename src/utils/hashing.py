@@ -0,0 +1,28 @@
+import hashlib
+import weakref
+import pandas as pd
+from typing import Dict, Tuple
+
+# Digests memoized per DataFrame object, dropped when the DataFrame is garbage collected
+_digests: Dict[int, Tuple[weakref.ref, bytes]] = {}
+
+def hash_dataframe(df: pd.DataFrame) -> bytes:
+    """
+    Returns a 16 byte content digest for a DataFrame to pass in place of the DataFrame itself
+    The digest is computed once per DataFrame object, so a DataFrame must not be modified in
+    place after it has been hashed.
+    """
+    key = id(df)
+    cached = _digests.get(key)
+    if cached is not None and cached[0]() is df:
+        return cached[1]
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr(tuple(df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    _digests[key] = (weakref.ref(df, lambda _: _digests.pop(key, None)), digest.digest())
+    return _digests[key][1]
+
+def hash_params(params: Dict) -> bytes:
+    """Returns a 16 byte digest of a parameter dict that does not depend on key order"""
+    return hashlib.blake2b(repr(sorted(params.items())).encode(), digest_size=16).digest()
\ No newline at end of file
@@ -1,29 +1,54 @@
+import streamlit as st
 import pydeck as pdk
 import pandas as pd
 import numpy as np
 from typing import Dict, List
+from src.utils.hashing import hash_dataframe
 
-def generate_color_scale(values: List[float], 
+def generate_color_scale(values: np.ndarray, 
                         min_alpha: int = 100, 
                         max_alpha: int = 200) -> List[List[int]]:
     """
     Generate colors for flows with alpha channel based on volume
     """
-    if not values:
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
         return []
         
-    min_val = min(values)
-    max_val = max(values)
+    min_val = values.min()
+    max_val = values.max()
     
     if min_val == max_val:
         return [[128, 0, 128, max_alpha]] * len(values)
         
-    colors = []
-    for val in values:
-        alpha = min_alpha + (max_alpha - min_alpha) * (val - min_val) / (max_val - min_val)
-        colors.append([128, 0, 128, int(alpha)])
-    return colors
+    colors = np.zeros((len(values), 4), dtype=np.int64)
+    colors[:, 0] = colors[:, 2] = 128
+    colors[:, 3] = min_alpha + (max_alpha - min_alpha) * (values - min_val) / (max_val - min_val)
+    return colors.tolist()
 
+def _flow_segments(
+    flows: pd.DataFrame,
+    start_coords: pd.DataFrame,
+    start_column: str,
+    end_coords: pd.DataFrame,
+    end_column: str,
+    loads_column: str,
+    segment_type: str
+) -> pd.DataFrame:
+    """Map segments from the start to the end city of each flow, with coordinates looked up by city"""
+    start = start_coords.loc[flows[start_column], ['Latitude', 'Longitude']].to_numpy()
+    end = end_coords.loc[flows[end_column], ['Latitude', 'Longitude']].to_numpy()
+    return pd.DataFrame({
+        'start_lat': start[:, 0],
+        'start_lon': start[:, 1],
+        'end_lat': end[:, 0],
+        'end_lon': end[:, 1],
+        'volume': flows['Volume'].to_numpy(),
+        'loads': flows[loads_column].to_numpy(),
+        'type': segment_type
+    }, index=flows.index)
+
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: hash_dataframe})
 def create_hub_network_map(
     connections_df: pd.DataFrame,
     facilities_df: pd.DataFrame,
@@ -44,61 +69,30 @@ def create_hub_network_map(
     Returns:
         Dictionary containing deck object and additional visualization info
     """
-    # Process connections data for visualization
-    viz_connections = []
-    
-    # Process direct connections
+    # Coordinates by city, from the first row listing each city as the lookups always used
+    origin_coords = origins_df.drop_duplicates('City').set_index('City')
+    dest_coords = destinations_df.drop_duplicates('City').set_index('City')
+    hub_coords = candidate_hubs_df.drop_duplicates('City').set_index('City')
+
+    # Segments of each flow type, with coordinates gathered for all flows at once
+    segments = []
     direct_flows = connections_df[connections_df['Type'] == 'Direct']
-    for _, flow in direct_flows.iterrows():
-        # Get coordinates
-        origin = origins_df[origins_df['City'] == flow['From']].iloc[0]
-        dest = destinations_df[destinations_df['City'] == flow['To']].iloc[0]
-        
-        viz_connections.append({
-            'start_lat': origin['Latitude'],
-            'start_lon': origin['Longitude'],
-            'end_lat': dest['Latitude'],
-            'end_lon': dest['Longitude'],
-            'volume': flow['Volume'],
-            'loads': flow['Loads'],
-            'type': 'Direct'
-        })
+    if not direct_flows.empty:
+        segments.append(_flow_segments(direct_flows, origin_coords, 'From', dest_coords, 'To', 'Loads', 'Direct'))
     
-    # Process hub connections
     hub_flows = connections_df[connections_df['Type'] == 'Hub']
-    for _, flow in hub_flows.iterrows():
-        # Origin to Hub segment
-        origin = origins_df[origins_df['City'] == flow['From']].iloc[0]
-        hub = candidate_hubs_df[candidate_hubs_df['City'] == flow['Via']].iloc[0]
-        
-        viz_connections.append({
-            'start_lat': origin['Latitude'],
-            'start_lon': origin['Longitude'],
-            'end_lat': hub['Latitude'],
-            'end_lon': hub['Longitude'],
-            'volume': flow['Volume'],
-            'loads': flow['LoadsOH'],
-            'type': 'Hub-Inbound'
-        })
-        
-        # Hub to Destination segment
-        dest = destinations_df[destinations_df['City'] == flow['To']].iloc[0]
-        
-        viz_connections.append({
-            'start_lat': hub['Latitude'],
-            'start_lon': hub['Longitude'],
-            'end_lat': dest['Latitude'],
-            'end_lon': dest['Longitude'],
-            'volume': flow['Volume'],
-            'loads': flow['LoadsHD'],
-            'type': 'Hub-Outbound'
-        })
+    if not hub_flows.empty:
+        # Each flow's origin to hub segment is followed by its hub to destination segment
+        segments.append(pd.concat([
+            _flow_segments(hub_flows, origin_coords, 'From', hub_coords, 'Via', 'LoadsOH', 'Hub-Inbound'),
+            _flow_segments(hub_flows, hub_coords, 'Via', dest_coords, 'To', 'LoadsHD', 'Hub-Outbound')
+        ]).sort_index(kind='stable'))
     
-    connections_viz_df = pd.DataFrame(viz_connections)
+    connections_viz_df = pd.concat(segments, ignore_index=True) if segments else pd.DataFrame()
     
     # Generate colors based on volume
     if not connections_viz_df.empty:
-        flow_colors = generate_color_scale(connections_viz_df['volume'].tolist())
+        flow_colors = generate_color_scale(connections_viz_df['volume'].to_numpy())
         connections_viz_df['color'] = flow_colors
     
     # Create layers
@@ -1,50 +1,114 @@
+import streamlit as st
 import pydeck as pdk
 import pandas as pd
-from typing import Dict
+import numpy as np
+from typing import Dict, Optional, Tuple
+from src.utils.hashing import hash_dataframe
 
-def create_optimization_map(
-    facilities_df: pd.DataFrame,
-    customers_df: pd.DataFrame,
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: hash_dataframe})
+def coord_arrays(df: pd.DataFrame, id_col: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the ids and float32 latitude/longitude columns of a location table as arrays"""
+    return (
+        df[id_col].to_numpy(),
+        df['Latitude'].to_numpy(np.float32),
+        df['Longitude'].to_numpy(np.float32)
+    )
+
+# Layer id -> key of the records in _optimization_map_data that the layer draws
+_LAYER_DATA = {
+    'facilities': 'facilities',
+    'customers': 'customers',
+    'connections': 'connections',
+    'facility-labels': 'facilities',
+    'customer-labels': 'customers'
+}
+
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: hash_dataframe})
+def _optimization_map_data(
+    fac_ids: np.ndarray,
+    fac_lat: np.ndarray,
+    fac_lon: np.ndarray,
+    cust_ids: np.ndarray,
+    cust_lat: np.ndarray,
+    cust_lon: np.ndarray,
     transport_df: pd.DataFrame,
-    facility_coords: Dict,
-    customer_coords: Dict,
-    results_df: pd.DataFrame  # Add results_df as a parameter
-) -> pdk.Deck:
-    """
-    Create an interactive map visualization of the optimization results
-    """
+    results_df: pd.DataFrame
+) -> Dict:
+    """Builds the layer records of the optimization map, once per solution"""
+    facility_index = pd.Index(fac_ids)
+    customer_index = pd.Index(cust_ids)
+
     # Prepare facilities data
+    facility_pos = facility_index.get_indexer(results_df['FacilityID'])
     facilities_map_df = pd.DataFrame({
-        'FacilityID': results_df['FacilityID'],
-        'lat': [facility_coords[f][0] for f in results_df['FacilityID']],
-        'lon': [facility_coords[f][1] for f in results_df['FacilityID']],
-        'Selected': results_df['Open']  # Changed from 'Selected' to 'Open' to match optimization output
+        'FacilityID': results_df['FacilityID'].to_numpy(),
+        'lat': fac_lat[facility_pos],
+        'lon': fac_lon[facility_pos],
+        'Selected': results_df['Open'].to_numpy()  # Changed from 'Selected' to 'Open' to match optimization output
     })
 
-    # Rest of the function remains the same
     customers_map_df = pd.DataFrame({
-        'CustomerID': customers_df['CustomerID'],
-        'lat': [customer_coords[c][0] for c in customers_df['CustomerID']],
-        'lon': [customer_coords[c][1] for c in customers_df['CustomerID']]
+        'CustomerID': cust_ids,
+        'lat': cust_lat,
+        'lon': cust_lon
+    })
+
+    start_pos = facility_index.get_indexer(transport_df['FacilityID'])
+    end_pos = customer_index.get_indexer(transport_df['CustomerID'])
+    connections_df = pd.DataFrame({
+        'start_lat': fac_lat[start_pos],
+        'start_lon': fac_lon[start_pos],
+        'end_lat': cust_lat[end_pos],
+        'end_lon': cust_lon[end_pos],
+        'amount': transport_df['TransportAmount'].to_numpy()
     })
 
-    connections = []
-    for _, row in transport_df.iterrows():
-        facility = row['FacilityID']
-        customer = row['CustomerID']
-        connections.append({
-            'start_lat': facility_coords[facility][0],
-            'start_lon': facility_coords[facility][1],
-            'end_lat': customer_coords[customer][0],
-            'end_lon': customer_coords[customer][1],
-            'amount': row['TransportAmount']
-        })
-    connections_df = pd.DataFrame(connections)
+    return {
+        'facilities': facilities_map_df.to_dict('records'),
+        'customers': customers_map_df.to_dict('records'),
+        'connections': connections_df.to_dict('records'),
+        'center': (float(facilities_map_df['lat'].mean()), float(facilities_map_df['lon'].mean()))
+    }
+
+def create_optimization_map(
+    fac_ids: np.ndarray,
+    fac_lat: np.ndarray,
+    fac_lon: np.ndarray,
+    cust_ids: np.ndarray,
+    cust_lat: np.ndarray,
+    cust_lon: np.ndarray,
+    transport_df: pd.DataFrame,
+    results_df: pd.DataFrame,
+    deck: Optional[pdk.Deck] = None
+) -> pdk.Deck:
+    """
+    Create an interactive map visualization of the optimization results
+    Args:
+        fac_ids, fac_lat, fac_lon: Facility coordinate arrays, as returned by coord_arrays
+        cust_ids, cust_lat, cust_lon: Customer coordinate arrays, as returned by coord_arrays
+        transport_df: Transportation plan from the optimization results
+        results_df: Facility open/closed decisions from the optimization results
+        deck: Deck from a previous call, whose layer data is replaced in place
+    """
+    map_data = _optimization_map_data(
+        fac_ids, fac_lat, fac_lon,
+        cust_ids, cust_lat, cust_lon,
+        transport_df, results_df
+    )
+    latitude, longitude = map_data['center']
+
+    if deck is not None:
+        for layer in deck.layers:
+            layer.data = map_data[_LAYER_DATA[layer.id]]
+        deck.initial_view_state.latitude = latitude
+        deck.initial_view_state.longitude = longitude
+        return deck
 
     layers = [
         pdk.Layer(
             "ScatterplotLayer",
-            facilities_map_df,
+            map_data['facilities'],
+            id='facilities',
             get_position=['lon', 'lat'],
             get_color=['(1-Selected) * 225', '(Selected) * 255', '0', '128'],
             get_radius=50000,
@@ -52,7 +116,8 @@ def create_optimization_map(
         ),
         pdk.Layer(
             "ScatterplotLayer",
-            customers_map_df,
+            map_data['customers'],
+            id='customers',
             get_position=['lon', 'lat'],
             get_color=[0, 0, 255, 128],
             get_radius=25000,
@@ -60,7 +125,8 @@ def create_optimization_map(
         ),
         pdk.Layer(
             "LineLayer",
-            connections_df,
+            map_data['connections'],
+            id='connections',
             get_source_position=['start_lon', 'start_lat'],
             get_target_position=['end_lon', 'end_lat'],
             get_color=[128, 0, 128, 100],
@@ -68,7 +134,8 @@ def create_optimization_map(
         ),
         pdk.Layer(
             "TextLayer",
-            facilities_map_df,
+            map_data['facilities'],
+            id='facility-labels',
             get_position=['lon', 'lat'],
             get_text='FacilityID',
             get_size=16,
@@ -79,7 +146,8 @@ def create_optimization_map(
         ),
         pdk.Layer(
             "TextLayer",
-            customers_map_df,
+            map_data['customers'],
+            id='customer-labels',
             get_position=['lon', 'lat'],
             get_text='CustomerID',
             get_size=12,
@@ -91,8 +159,8 @@ def create_optimization_map(
     ]
 
     view_state = pdk.ViewState(
-        latitude=facilities_map_df['lat'].mean(),
-        longitude=facilities_map_df['lon'].mean(),
+        latitude=latitude,
+        longitude=longitude,
         zoom=3,
         pitch=0,
     )
@@ -1,7 +1,10 @@
+import streamlit as st
 import pydeck as pdk
 import pandas as pd
 from typing import Dict, List
+from src.utils.hashing import hash_dataframe
 
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: hash_dataframe})
 def create_pso_map(
     facility_locations_df: pd.DataFrame,
     customers_df: pd.DataFrame,
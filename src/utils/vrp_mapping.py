@@ -1,81 +1,154 @@
+from functools import lru_cache
+from itertools import chain
+import streamlit as st
 import pydeck as pdk
 import pandas as pd
 import numpy as np
-from typing import List
+from typing import Dict, List, Optional, Tuple
+from src.utils.hashing import hash_dataframe
 
-def generate_vehicle_colors(num_vehicles: int) -> List[List[int]]:
-    """Generate distinct colors for number of vehicles"""
-    base_colors = [
-        [239, 71, 111],   # Red
-        [6, 214, 160],    # Green
-        [17, 138, 178],   # Blue
-        [255, 209, 102],  # Yellow
-        [7, 59, 76],      # Dark Blue
-        [255, 107, 107],  # Coral
-        [97, 212, 198],   # Turquoise
-        [122, 81, 149],   # Purple
-        [242, 132, 130],  # Salmon
-        [146, 188, 222],  # Light Blue
-    ]
-    
-    if num_vehicles <= len(base_colors):
-        return base_colors[:num_vehicles]
+# Above this many route arcs the arcs are not pickable, as picking allocates a color buffer per arc
+MAX_PICKABLE_ARCS = 10_000
+
+# Palette for the first vehicles; any further vehicles get evenly spaced hues
+BASE_COLORS = (
+    (239, 71, 111),   # Red
+    (6, 214, 160),    # Green
+    (17, 138, 178),   # Blue
+    (255, 209, 102),  # Yellow
+    (7, 59, 76),      # Dark Blue
+    (255, 107, 107),  # Coral
+    (97, 212, 198),   # Turquoise
+    (122, 81, 149),   # Purple
+    (242, 132, 130),  # Salmon
+    (146, 188, 222),  # Light Blue
+)
+
+@lru_cache(maxsize=32)
+def generate_vehicle_colors(num_vehicles: int) -> Tuple[Tuple[int, int, int], ...]:
+    """Generate distinct colors for number of vehicles, memoized as the palette only depends on the count"""
+    if num_vehicles <= 0:
+        return ()
+    if num_vehicles <= len(BASE_COLORS):
+        return BASE_COLORS[:num_vehicles]
     
-    # If more vehicles than base colors, generate additional colors
-    import colorsys
-    additional_colors = []
-    for i in range(num_vehicles - len(base_colors)):
-        hue = i / (num_vehicles - len(base_colors))
-        rgb = colorsys.hsv_to_rgb(hue, 0.8, 0.9)
-        additional_colors.append([int(c * 255) for c in rgb])
+    # If more vehicles than base colors, generate additional colors from evenly spaced hues at
+    # saturation 0.8 and value 0.9, converted to RGB as colorsys.hsv_to_rgb does
+    num_additional = num_vehicles - len(BASE_COLORS)
+    hue_sextant = np.arange(num_additional) / num_additional * 6.0
+    sector = hue_sextant.astype(int)
+    fraction = hue_sextant - sector
+    value, saturation = 0.9, 0.8
+    p = np.full(num_additional, value * (1.0 - saturation))
+    q = value * (1.0 - saturation * fraction)
+    t = value * (1.0 - saturation * (1.0 - fraction))
+    v = np.full(num_additional, value)
+    rgb = np.stack([
+        np.choose(sector, [v, q, p, p, t, v]),
+        np.choose(sector, [t, v, v, q, p, p]),
+        np.choose(sector, [p, p, t, v, v, q])
+    ], axis=1)
+    additional_colors = (rgb * 255).astype(int).tolist()
     
-    return base_colors + additional_colors
+    return BASE_COLORS + tuple(map(tuple, additional_colors))
 
-def create_vrp_map(
+@st.cache_data(show_spinner=False, hash_funcs={pd.DataFrame: hash_dataframe})
+def _vrp_map_data(
     locations_df: pd.DataFrame,
     routes: List[List[int]],
-) -> pdk.Deck:
-    """Create an interactive map visualization for VRP results"""
-    
+) -> Dict:
+    """Builds the layer DataFrames of the VRP map, once per solution"""
     vehicle_colors = generate_vehicle_colors(len(routes))
     
-    # Prepare route data
-    route_data = []
-    for i, route in enumerate(routes):
-        color = vehicle_colors[i]
-        for j in range(len(route) - 1):
-            start = route[j]
-            end = route[j + 1]
-            route_data.append({
-                'start_lat': locations_df.loc[start, 'Latitude'],
-                'start_lon': locations_df.loc[start, 'Longitude'],
-                'end_lat': locations_df.loc[end, 'Latitude'],
-                'end_lon': locations_df.loc[end, 'Longitude'],
-                'color': color,
-                'vehicle_id': i + 1
-            })
-    route_df = pd.DataFrame(route_data)
+    # Route arcs, with coordinates gathered by position for all arcs at once. The stops of all
+    # routes are flattened in one pass, and every stop but the last of its route starts an arc
+    stops = np.fromiter(chain.from_iterable(routes), dtype=int)
+    route_lengths = np.fromiter(map(len, routes), dtype=int, count=len(routes))
+    starts_arc = np.ones(len(stops), dtype=bool)
+    starts_arc[np.cumsum(route_lengths)[route_lengths > 0] - 1] = False
+    starts = stops[starts_arc]
+    ends = stops[np.flatnonzero(starts_arc) + 1]
+    vehicle_index = np.repeat(np.arange(len(routes)), np.maximum(route_lengths - 1, 0))
+    latitudes = locations_df['Latitude'].to_numpy()
+    longitudes = locations_df['Longitude'].to_numpy()
+    # Colors are stored as one uint8 column per channel rather than a column of tuples
+    arc_colors = np.asarray(vehicle_colors, dtype=np.uint8).reshape(-1, 3)[vehicle_index]
+    route_df = pd.DataFrame({
+        'start_lat': latitudes[starts],
+        'start_lon': longitudes[starts],
+        'end_lat': latitudes[ends],
+        'end_lon': longitudes[ends],
+        'color_r': arc_colors[:, 0],
+        'color_g': arc_colors[:, 1],
+        'color_b': arc_colors[:, 2],
+        'vehicle_id': vehicle_index + 1
+    })
+
+    # Depot and delivery locations, split with one comparison
+    is_depot = locations_df['Location_ID'].to_numpy() == 0
+    
+    # Map center, the mean of both coordinates in one reduction
+    center_lat, center_lon = locations_df[['Latitude', 'Longitude']].to_numpy(dtype=float).mean(axis=0)
+
+    # The layers take the frames as they are; pydeck only converts them to rows when the layer
+    # data is set, so the cached value stays columnar
+    return {
+        'routes': route_df,
+        'deliveries': locations_df[~is_depot],
+        'depot': locations_df[is_depot],
+        'center': (float(center_lat), float(center_lon)),
+        'vehicle_colors': vehicle_colors
+    }
+
+def create_vrp_map(
+    locations_df: pd.DataFrame,
+    routes: List[List[int]],
+    deck: Optional[pdk.Deck] = None
+) -> Dict:
+    """
+    Create an interactive map visualization for VRP results
+    Args:
+        locations_df: Locations the routes index into, depot first
+        routes: Stop positions of each route
+        deck: Deck from a previous call, whose layer data is replaced in place
+    Returns:
+        Dictionary with the deck and the color of each vehicle
+    """
+    map_data = _vrp_map_data(locations_df, routes)
+    latitude, longitude = map_data['center']
+    pickable_routes = len(map_data['routes']) <= MAX_PICKABLE_ARCS
+
+    if deck is not None:
+        for layer in deck.layers:
+            layer.data = map_data[layer.id]
+            if layer.id == 'routes':
+                layer.pickable = layer.auto_highlight = pickable_routes
+        deck.initial_view_state.latitude = latitude
+        deck.initial_view_state.longitude = longitude
+        return {'deck': deck, 'vehicle_colors': map_data['vehicle_colors']}
 
     # Create layers
     layers = [
         # Routes layer
         pdk.Layer(
             "ArcLayer",
-            data=route_df,
+            data=map_data['routes'],
+            id='routes',
             get_width=3,
             get_source_position=["start_lon", "start_lat"],
             get_target_position=["end_lon", "end_lat"],
             get_tilt=15,
-            get_source_color="color",
-            get_target_color="color",
-            pickable=True,
-            auto_highlight=True,
+            get_source_color=["color_r", "color_g", "color_b"],
+            get_target_color=["color_r", "color_g", "color_b"],
+            pickable=pickable_routes,
+            auto_highlight=pickable_routes,
         ),
         
         # Delivery locations layer
         pdk.Layer(
             "ScatterplotLayer",
-            data=locations_df[locations_df['Location_ID'] != 0],
+            data=map_data['deliveries'],
+            id='deliveries',
             get_position=["Longitude", "Latitude"],
             get_color=[200, 30, 0, 160],
             get_radius=200,
@@ -85,7 +158,8 @@ def create_vrp_map(
         # Depot layer
         pdk.Layer(
             "ScatterplotLayer",
-            data=locations_df[locations_df['Location_ID'] == 0],
+            data=map_data['depot'],
+            id='depot',
             get_position=["Longitude", "Latitude"],
             get_color=[0, 255, 0, 160],
             get_radius=300,
@@ -95,8 +169,8 @@ def create_vrp_map(
 
     # Set view state
     view_state = pdk.ViewState(
-        latitude=np.mean(locations_df['Latitude']),
-        longitude=np.mean(locations_df['Longitude']),
+        latitude=latitude,
+        longitude=longitude,
         zoom=11,
         pitch=30,
     )
@@ -112,5 +186,5 @@ def create_vrp_map(
                         "<b>Time Window:</b> {Time_Window_Start} - {Time_Window_End}"
             },
         ),
-        'vehicle_colors': vehicle_colors
+        'vehicle_colors': map_data['vehicle_colors']
     }
\ No newline at end of file